@@ -1,8 +1,21 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
-from .security import get_password_hash
+from pydantic import TypeAdapter
+from sqlalchemy import and_, func, insert, literal, or_, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
+from . import models, schemas, search
+from .cache import TTLCache
+from .security import get_password_hash, get_password_hash_async
+import base64
+import json
+import os
+import random
 import secrets
-from datetime import timedelta, datetime
+import time
+import weakref
+from datetime import timedelta, datetime, timezone
+from typing import List
 
 # CRUD helpers encapsulate DB access and business logic so routers remain thin.
 # Each function receives a `db: Session` and performs necessary queries/commits.
@@ -10,19 +23,257 @@ from datetime import timedelta, datetime
 
 def create_product(db: Session, product_in: schemas.ProductCreate) -> models.Product:
     # Create and persist a Product from the Pydantic input schema
-    p = models.Product(name=product_in.name, price=product_in.price, image_url=product_in.image_url)
+    p = models.Product(
+        name=product_in.name, price=product_in.price, image_url=product_in.image_url, sku=product_in.sku,
+        stock=product_in.stock,
+    )
     db.add(p)
+    bump_catalog_version(db)
     db.commit()
     db.refresh(p)
+    invalidate_catalog()
     return p
 
 
-def list_products(db: Session, skip: int = 0, limit: int = 100):
-    # Return a tuple (items, total) to support pagination metadata
-    q = db.query(models.Product)
-    total = q.count()
-    items = q.offset(skip).limit(limit).all()
-    return items, total
+def upsert_products(db: Session, rows: list) -> int:
+    # Write a batch of product dicts (ProductCreate fields) in one transaction.
+    # Rows with a `sku` are upserted on it (last one wins within the batch);
+    # rows without are inserted. Both go through executemany. Returns the
+    # number of rows written. Catalog caches are invalidated by the caller.
+    # An upserted row without `stock` keeps the product's current stock.
+    keyed = {}
+    plain = []
+    for row in rows:
+        if row.get("sku"):
+            keyed[row["sku"]] = row
+        else:
+            plain.append(row)
+    if keyed:
+        stmt = _upsert(db, models.Product)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Product.sku],
+            set_={
+                **{col: getattr(stmt.excluded, col) for col in ("name", "price", "image_url")},
+                "stock": func.coalesce(stmt.excluded.stock, models.Product.stock),
+            },
+        )
+        db.execute(stmt, list(keyed.values()))
+    if plain:
+        db.execute(models.Product.__table__.insert(), plain)
+    bump_catalog_version(db)
+    db.commit()
+    return len(keyed) + len(plain)
+
+
+def set_image_variants(db: Session, image_url: str, variants: dict) -> int:
+    # Record derived image URLs on every product showing `image_url`
+    # (uploads are deduplicated, so several products can share one file)
+    updated = db.query(models.Product).filter(models.Product.image_url == image_url).update(
+        {models.Product.image_variants: variants}, synchronize_session=False
+    )
+    if updated:
+        bump_catalog_version(db)
+    db.commit()
+    invalidate_catalog()
+    return updated
+
+
+# Catalog read caches. Product rows are cached as `schemas.Product` snapshots
+# (never ORM instances, which are bound to the session that loaded them), list
+# pages by their normalized query, and totals per search filter because
+# COUNT(*) scans every match. Writes through this module clear them; other
+# workers notice the bumped `catalog` row in `cache_versions` within
+# CATALOG_VERSION_POLL seconds.
+#
+# The stamp is read through the caller's session, which is the replica for
+# catalog GETs and the primary elsewhere, so the last seen version is kept
+# per engine: a lagging replica then clears the caches once when it catches
+# up (dropping rows filled from it while stale) instead of on every poll
+# that alternates between the two.
+_product_cache = TTLCache(maxsize=4096, ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60")))
+_listing_cache = TTLCache(maxsize=512, ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60")))
+_product_counts = TTLCache(maxsize=256, ttl=float(os.getenv("PRODUCT_COUNT_TTL", "30")))
+CATALOG_VERSION_POLL = float(os.getenv("CATALOG_VERSION_POLL", "2"))
+_catalog_versions = weakref.WeakKeyDictionary()  # engine -> (version, checked_at)
+
+
+def invalidate_catalog():
+    # Drop every cached catalog read in this process
+    _product_cache.clear()
+    _listing_cache.clear()
+    _product_counts.clear()
+
+
+def bump_catalog_version(db: Session):
+    # Record a catalog change in the current transaction (committed by the caller)
+    updated = db.query(models.CacheVersion).filter(models.CacheVersion.name == "catalog").update(
+        {models.CacheVersion.version: models.CacheVersion.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(models.CacheVersion(name="catalog", version=1))
+
+
+def _check_catalog_version(db: Session):
+    # At most every CATALOG_VERSION_POLL seconds per engine, compare the
+    # shared version stamp with the one last seen on that engine
+    bind = db.get_bind()
+    bind = getattr(bind, "engine", bind)
+    seen, checked_at = _catalog_versions.get(bind, (None, 0.0))
+    now = time.monotonic()
+    if seen is not None and now - checked_at < CATALOG_VERSION_POLL:
+        return
+    version = db.query(models.CacheVersion.version).filter(models.CacheVersion.name == "catalog").scalar() or 0
+    if version != seen:
+        invalidate_catalog()
+    _catalog_versions[bind] = (version, now)
+
+
+def catalog_cache_stats() -> dict:
+    return {
+        "products": _product_cache.stats(),
+        "listings": _listing_cache.stats(),
+        "counts": _product_counts.stats(),
+    }
+
+
+def encode_cursor(values: dict) -> str:
+    # Opaque pagination cursor: urlsafe base64 of a compact JSON object
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    # Inverse of `encode_cursor`. Raises ValueError on malformed input.
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, dict) or not isinstance(values.get("id"), int):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _normalize_q(q: str = None) -> str:
+    return " ".join((q or "").lower().split())
+
+
+# Columns of `schemas.Product`. Read paths select these as plain row tuples,
+# which skips building (and identity-mapping) ORM instances.
+PRODUCT_COLUMNS = (
+    models.Product.id,
+    models.Product.name,
+    models.Product.price,
+    models.Product.image_url,
+    models.Product.sku,
+    models.Product.image_variants,
+)
+
+
+# Listing sort orders: name -> (column, descending). Each has a composite
+# (column, id) index, so a sorted page is a range scan of that index rather
+# than a sort over every match; id makes the order total for keyset paging.
+PRODUCT_SORTS = {
+    "price": (models.Product.price, False),
+    "name": (models.Product.name, False),
+    "newest": (models.Product.created_at, True),
+}
+
+
+def _product_query(db: Session, q: str = None, min_price: float = None, max_price: float = None):
+    # Base listing query (rows of PRODUCT_COLUMNS) plus the relevance
+    # expression when searching (or None)
+    query = db.query(*PRODUCT_COLUMNS)
+    if min_price is not None:
+        query = query.filter(models.Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(models.Product.price <= max_price)
+    if q:
+        return search.apply_search(query, q)
+    return query, None
+
+
+def count_products(db: Session, q: str = None, min_price: float = None, max_price: float = None) -> int:
+    # Cached total for a filter; see `_product_counts`
+    key = (_normalize_q(q), min_price, max_price)
+    total = _product_counts.get(key)
+    if total is None:
+        total = _product_query(db, q, min_price, max_price)[0].count()
+        _product_counts.set(key, total)
+    return total
+
+
+def list_products(db: Session, skip: int = 0, limit: int = 100, q: str = None,
+                  after: str = None, with_total: bool = True, sort: str = None,
+                  min_price: float = None, max_price: float = None):
+    # Cached wrapper around `_list_products`; items are `schemas.Product` snapshots
+    _check_catalog_version(db)
+    key = (_normalize_q(q), sort, min_price, max_price, None if after else skip, limit, after, with_total)
+    page = _listing_cache.get(key)
+    if page is None:
+        items, total, next_cursor = _list_products(
+            db, skip, limit, q, after, with_total, sort, min_price, max_price
+        )
+        page = ([schemas.Product.model_validate(p) for p in items], total, next_cursor)
+        _listing_cache.set(key, page)
+    return page
+
+
+def _list_products(db: Session, skip: int, limit: int, q: str, after: str, with_total: bool,
+                   sort: str = None, min_price: float = None, max_price: float = None):
+    # Return a tuple (items, total, next_cursor) to support pagination metadata.
+    # With `after` (a cursor from a previous page) rows are fetched by seeking
+    # on the sort key, so every page costs the same regardless of depth;
+    # otherwise classic OFFSET paging is used for older clients. `sort` picks
+    # one of PRODUCT_SORTS; without it searches are ordered by relevance and
+    # everything else by id. `total` is None when `with_total` is False.
+    query, key = _product_query(db, q, min_price, max_price)
+    if sort is not None:
+        # Like `list_user_orders`, the cursor holds only the last id and its
+        # sort value is read back in a subquery
+        column, descending = PRODUCT_SORTS[sort]
+        if descending:
+            query = query.order_by(column.desc(), models.Product.id.desc())
+        else:
+            query = query.order_by(column, models.Product.id)
+        key = None
+    elif key is not None:
+        query = query.add_columns(key).order_by(key, models.Product.id)
+    else:
+        query = query.order_by(models.Product.id)
+    if after:
+        cursor = decode_cursor(after)
+        if sort is not None:
+            last = select(column.label("k"), models.Product.id).where(models.Product.id == cursor["id"]).subquery()
+            position = tuple_(select(last.c.k).scalar_subquery(), select(last.c.id).scalar_subquery())
+            seek = tuple_(column, models.Product.id)
+            query = query.filter(seek < position if descending else seek > position)
+        elif key is None:
+            query = query.filter(models.Product.id > cursor["id"])
+        elif "k" in cursor:
+            query = query.filter(or_(key > cursor["k"], and_(key == cursor["k"], models.Product.id > cursor["id"])))
+        else:
+            raise ValueError("Invalid cursor")
+    else:
+        query = query.offset(skip)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        if key is None:
+            next_cursor = encode_cursor({"id": last.id})
+        else:
+            next_cursor = encode_cursor({"k": last[-1], "id": last.id})
+    items = rows[:limit]
+    total = count_products(db, q, min_price, max_price) if with_total else None
+    return items, total, next_cursor
+
+
+def suggest_products(db: Session, q: str, limit: int = 10):
+    # Autocomplete: best prefix matches for partially typed input
+    query, rank = _product_query(db, q)
+    query = query.order_by(rank, models.Product.id) if rank is not None else query.order_by(models.Product.name)
+    return query.limit(limit).all()
 
 
 def get_product(db: Session, product_id: int):
@@ -30,95 +281,701 @@ def get_product(db: Session, product_id: int):
     return db.query(models.Product).filter(models.Product.id == product_id).first()
 
 
-def create_cart(db: Session) -> models.Cart:
-    # Create an empty cart. Cart may be linked to a user later.
-    c = models.Cart()
+def get_product_cached(db: Session, product_id: int):
+    # Like `get_product` but served from the catalog cache as a read-only
+    # `schemas.Product` snapshot. Misses are not cached.
+    _check_catalog_version(db)
+    product = _product_cache.get(product_id)
+    if product is None:
+        row = db.query(*PRODUCT_COLUMNS).filter(models.Product.id == product_id).first()
+        if row is None:
+            return None
+        product = schemas.Product.model_validate(row)
+        _product_cache.set(product_id, product)
+    return product
+
+
+def get_products_cached(db: Session, product_ids: list) -> dict:
+    # Many-id form of `get_product_cached`: {id: snapshot} for the ids that
+    # exist. Cache misses are read in one IN query and cached.
+    _check_catalog_version(db)
+    found = {}
+    misses = []
+    for product_id in product_ids:
+        product = _product_cache.get(product_id)
+        if product is None:
+            misses.append(product_id)
+        else:
+            found[product_id] = product
+    if misses:
+        for row in db.query(*PRODUCT_COLUMNS).filter(models.Product.id.in_(misses)):
+            product = schemas.Product.model_validate(row)
+            _product_cache.set(row.id, product)
+            found[row.id] = product
+    return found
+
+
+def create_cart(db: Session, user_id: int = None) -> models.Cart:
+    # Create an empty cart, owned by `user_id` when the caller is signed in.
+    c = models.Cart(user_id=user_id)
     db.add(c)
     db.commit()
     db.refresh(c)
     return c
 
 
-def get_cart(db: Session, cart_id: int):
-    # Retrieve a cart by id
-    return db.query(models.Cart).filter(models.Cart.id == cart_id).first()
+def get_cart(db: Session, cart_id: int, load_items: bool = True):
+    # Retrieve a cart by id. With `load_items` its lines and their products are
+    # loaded up front (three queries in total, whatever the cart size) so
+    # serializing `schemas.Cart` triggers no lazy loads.
+    query = db.query(models.Cart).filter(models.Cart.id == cart_id)
+    if load_items:
+        query = query.options(selectinload(models.Cart.items).selectinload(models.CartItem.product))
+    return query.first()
+
 
+def _get_cart_item(db: Session, item_id: int):
+    # A single cart line with its product joined in
+    return (
+        db.query(models.CartItem)
+        .options(joinedload(models.CartItem.product))
+        .filter(models.CartItem.id == item_id)
+        .first()
+    )
 
-def add_item_to_cart(db: Session, cart: models.Cart, product: models.Product, quantity: int = 1):
+
+def _upsert(db: Session, model):
+    # Dialect-specific INSERT supporting ON CONFLICT (SQLite and PostgreSQL)
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"upsert is not supported on {dialect}")
+
+
+def add_item_to_cart(db: Session, cart: models.Cart, product: schemas.Product, quantity: int = 1):
     # Add or update a CartItem for the given cart and product. Commits are
     # performed here to persist changes immediately for this simple demo.
-    for item in cart.items:
-        if item.product_id == product.id:
-            item.quantity += quantity
-            db.add(item)
-            db.commit()
-            db.refresh(item)
-            return item
-    item = models.CartItem(cart=cart, product=product, quantity=quantity)
-    db.add(item)
-    db.commit()
-    db.refresh(item)
-    return item
+    # Only `product.id` is used, so a cached snapshot works as well as a row.
+    # An existing line is bumped by the database in the same statement
+    # (INSERT ... ON CONFLICT DO UPDATE) instead of scanning `cart.items`.
+    stmt = _upsert(db, models.CartItem).values(cart_id=cart.id, product_id=product.id, quantity=quantity)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.CartItem.cart_id, models.CartItem.product_id],
+        set_={"quantity": models.CartItem.quantity + stmt.excluded.quantity},
+    ).returning(models.CartItem.id)
+    item_id = db.execute(stmt).scalar_one()
+    db.commit()
+    return _get_cart_item(db, item_id)
+
+
+def apply_cart_updates(db: Session, cart: models.Cart, updates: list) -> models.Cart:
+    # Apply many `schemas.CartLineUpdate`s in one transaction. Lines for the
+    # same product are folded in order first, then all products are checked
+    # with a single query and changes are written with at most three
+    # statements plus a cleanup of lines left at zero. Raises LookupError
+    # listing unknown product ids (nothing is written in that case).
+    final = {}
+    for u in updates:
+        op, qty = final.get(u.product_id, ("increment", 0))
+        if u.op == "remove":
+            final[u.product_id] = ("set", 0)
+        elif u.op == "set":
+            final[u.product_id] = ("set", u.quantity)
+        else:
+            final[u.product_id] = (op, qty + u.quantity)
+
+    wanted = {pid for pid, (op, qty) in final.items() if op == "increment" or qty > 0}
+    if wanted:
+        found = {pid for (pid,) in db.query(models.Product.id).filter(models.Product.id.in_(wanted))}
+        missing = sorted(wanted - found)
+        if missing:
+            raise LookupError(f"Products not found: {missing}")
+
+    removals = [pid for pid, (op, qty) in final.items() if op == "set" and qty <= 0]
+    sets = [{"cart_id": cart.id, "product_id": pid, "quantity": qty} for pid, (op, qty) in final.items() if op == "set" and qty > 0]
+    increments = [{"cart_id": cart.id, "product_id": pid, "quantity": qty} for pid, (op, qty) in final.items() if op == "increment" and qty]
+    key = [models.CartItem.cart_id, models.CartItem.product_id]
+    if removals:
+        db.query(models.CartItem).filter(
+            models.CartItem.cart_id == cart.id, models.CartItem.product_id.in_(removals)
+        ).delete(synchronize_session=False)
+    if sets:
+        stmt = _upsert(db, models.CartItem)
+        db.execute(stmt.on_conflict_do_update(index_elements=key, set_={"quantity": stmt.excluded.quantity}), sets)
+    if increments:
+        stmt = _upsert(db, models.CartItem)
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=key, set_={"quantity": models.CartItem.quantity + stmt.excluded.quantity}
+            ),
+            increments,
+        )
+        db.query(models.CartItem).filter(
+            models.CartItem.cart_id == cart.id, models.CartItem.quantity <= 0
+        ).delete(synchronize_session=False)
+    db.commit()
+    db.expire(cart)
+    return get_cart(db, cart.id)
 
 
 def remove_item_from_cart(db: Session, cart: models.Cart, item_id: int):
     # Remove a cart item by id if it belongs to the given cart
-    item = db.query(models.CartItem).filter(models.CartItem.id == item_id, models.CartItem.cart_id == cart.id).first()
+    item = (
+        db.query(models.CartItem)
+        .options(joinedload(models.CartItem.product))
+        .filter(models.CartItem.id == item_id, models.CartItem.cart_id == cart.id)
+        .first()
+    )
     if item:
         db.delete(item)
         db.commit()
     return item
 
 
-def create_order_from_cart(db: Session, cart: models.Cart) -> models.Order:
-    # Convert a cart into an order. This is a simple synchronous flow that:
-    # 1) creates an Order, 2) creates OrderItem rows for each CartItem, and
-    # 3) clears cart items. In production you'd want to check stock, validate
-    # prices, and possibly run this in a transactional/queued workflow.
-    if not cart.items:
-        raise ValueError("Cart is empty")
-    total = 0.0
-    order = models.Order(total_amount=0.0)
+def create_order_from_cart(db: Session, cart: models.Cart, idempotency_key: str = None,
+                           user_id: int = None) -> models.Order:
+    # Convert a cart into an order with a fixed number of statements:
+    # 1) lock the cart row (concurrent checkouts of the same cart queue here,
+    #    and the later ones find it empty), 2) insert the Order, 3) copy every
+    #    line with its current price in one INSERT ... SELECT, 4) read the
+    #    lines back with their products to total the order and store its
+    #    snapshot (`lines_json`), 5) reserve stock of tracked products with
+    #    conditional decrements (see `_reserve_stock`) and 6) clear the cart,
+    #    all in one transaction.
+    # With `idempotency_key`, a retry returns the order the key first created.
+    # The order belongs to the cart's owner, else to `user_id` (the signed-in
+    # caller checking out an anonymous cart).
+    # Raises ValueError if the cart is empty or the key belongs to another
+    # cart, and OutOfStock (a ValueError) if a line can't be reserved.
+    if idempotency_key:
+        existing = _order_for_key(db, cart, idempotency_key)
+        if existing:
+            return existing
+    db.query(models.Cart).filter(models.Cart.id == cart.id).update(
+        {models.Cart.version: func.coalesce(models.Cart.version, 0) + 1}, synchronize_session=False
+    )
+    if idempotency_key:
+        # A concurrent retry may have committed while we waited for the lock
+        existing = _order_for_key(db, cart, idempotency_key)
+        if existing:
+            db.rollback()
+            return existing
+
+    order = models.Order(total_amount=0.0, user_id=cart.user_id or user_id, cart_id=cart.id, idempotency_key=idempotency_key)
     db.add(order)
+    try:
+        db.flush()
+    except IntegrityError:
+        # Same key committed by a request for another cart meanwhile
+        db.rollback()
+        existing = _order_for_key(db, cart, idempotency_key)
+        if existing:
+            return existing
+        raise
+    lines = (
+        select(
+            literal(order.id), models.CartItem.product_id, models.CartItem.quantity, models.Product.price
+        )
+        .join(models.Product, models.Product.id == models.CartItem.product_id)
+        .where(models.CartItem.cart_id == cart.id)
+    )
+    copied = db.execute(
+        insert(models.OrderItem).from_select(["order_id", "product_id", "quantity", "unit_price"], lines)
+    ).rowcount
+    if not copied:
+        db.rollback()
+        raise ValueError("Cart is empty")
+    # Read the lines back with their products to total the order and store
+    # the snapshot served by `get_order_json`
+    rows = (
+        db.query(
+            models.OrderItem.id.label("line_id"),
+            models.OrderItem.quantity,
+            models.OrderItem.unit_price,
+            models.Product.stock,
+            models.Product.stock_shards,
+            *PRODUCT_COLUMNS,
+        )
+        .join(models.Product, models.Product.id == models.OrderItem.product_id)
+        .filter(models.OrderItem.order_id == order.id)
+        .order_by(models.OrderItem.id)
+        .all()
+    )
+    items = [
+        schemas.OrderItem(
+            id=row.line_id,
+            quantity=row.quantity,
+            unit_price=row.unit_price,
+            product=schemas.Product.model_validate(row),
+        )
+        for row in rows
+    ]
+    order.total_amount = sum(item.unit_price * item.quantity for item in items)
+    order.lines_json = _order_lines.dump_json(items).decode()
+    tracked = [row for row in rows if row.stock is not None or row.stock_shards]
+    if tracked:
+        _reserve_stock(db, cart.id, tracked)
+        order.reserved_until = datetime.utcnow() + timedelta(seconds=STOCK_RESERVATION_SECONDS)
+    db.query(models.CartItem).filter(models.CartItem.cart_id == cart.id).delete(synchronize_session=False)
+    db.commit()
+    return order
+
+
+# Stock. `Product.stock` NULL means unlimited. Checkout takes stock with
+# conditional decrements (`... SET stock = stock - n WHERE stock >= n`), so
+# the row lock is held only for the UPDATE itself and to the end of the
+# checkout transaction, concurrent buyers never read-modify-write, and a
+# counter can't go negative: a decrement that would is simply not applied.
+# An unpaid order holds its stock until `reserved_until`
+# (STOCK_RESERVATION_SECONDS after checkout; provider checkout sessions end
+# with it, extending it if they must, but never past
+# STOCK_RESERVATION_MAX_SECONDS after the order was placed), then
+# `release_expired_reservations` puts it back. A payment landing after that
+# takes the stock again or is kept for refund (see `record_payment`).
+# Products with `stock_shards` spread their stock over `StockShard` rows so
+# flash-sale traffic on one item contends on several rows instead of one
+# (this helps on PostgreSQL; SQLite serializes all writes anyway).
+STOCK_RESERVATION_SECONDS = int(os.getenv("STOCK_RESERVATION_SECONDS", str(2 * 60 * 60)))
+STOCK_RESERVATION_MAX_SECONDS = int(os.getenv("STOCK_RESERVATION_MAX_SECONDS", str(6 * 60 * 60)))
+
+
+class OutOfStock(ValueError):
+    """Raised by checkout when some lines can't be reserved; `product_ids`
+    lists the products short of stock."""
+
+    def __init__(self, product_ids):
+        super().__init__(f"Insufficient stock for product(s) {', '.join(map(str, product_ids))}")
+        self.product_ids = list(product_ids)
+
+
+def _reserve_stock(db: Session, cart_id: int, lines):
+    # Decrement stock for `lines` (rows with product `id`, `quantity`,
+    # `stock_shards`) inside the checkout transaction; on any shortfall roll
+    # the whole checkout back and raise OutOfStock.
+    plain = [line for line in lines if not line.stock_shards]
+    wanted = (
+        select(models.CartItem.quantity)
+        .where(models.CartItem.cart_id == cart_id, models.CartItem.product_id == models.Product.id)
+        .scalar_subquery()
+    )
+    complete = True
+    if plain:
+        # One statement for every plain line; each product's quantity comes
+        # from its (unique) cart line
+        taken = db.query(models.Product).filter(
+            models.Product.id.in_([line.id for line in plain]),
+            models.Product.stock.isnot(None),
+            models.Product.stock >= wanted,
+        ).update({models.Product.stock: models.Product.stock - wanted}, synchronize_session=False)
+        complete = taken == len(plain)
+    short = []
+    if complete:
+        short = [line.id for line in lines if line.stock_shards and not _take_sharded(db, line.id, line.quantity)]
+    if complete and not short:
+        return
+    db.rollback()
+    if not complete:
+        # Report from the rolled-back state, where no line has been taken yet
+        short = [
+            pid for (pid,) in db.query(models.Product.id).filter(
+                models.Product.id.in_([line.id for line in plain]), models.Product.stock < wanted
+            )
+        ] or [line.id for line in plain]
+    raise OutOfStock(sorted(short))
+
+
+def _take_sharded(db: Session, product_id: int, quantity: int) -> bool:
+    # Take `quantity` from a random shard that holds enough; near sell-out,
+    # when no single shard does, gather it from several
+    Shard = models.StockShard
+    shards = [shard for (shard,) in db.query(Shard.shard).filter(Shard.product_id == product_id)]
+    random.shuffle(shards)
+    for shard in shards:
+        taken = db.query(Shard).filter(
+            Shard.product_id == product_id, Shard.shard == shard, Shard.stock >= quantity
+        ).update({Shard.stock: Shard.stock - quantity}, synchronize_session=False)
+        if taken:
+            return True
+    locked = (
+        db.query(Shard).filter(Shard.product_id == product_id, Shard.stock > 0)
+        .order_by(Shard.shard).with_for_update().all()
+    )
+    if sum(shard.stock for shard in locked) < quantity:
+        return False
+    remaining = quantity
+    for shard in locked:
+        take = min(shard.stock, remaining)
+        shard.stock -= take
+        remaining -= take
+        if not remaining:
+            break
     db.flush()
-    for item in cart.items:
-        unit_price = item.product.price
-        oi = models.OrderItem(order=order, product_id=item.product_id, quantity=item.quantity, unit_price=unit_price)
-        db.add(oi)
-        total += unit_price * item.quantity
-    order.total_amount = total
-    # remove cart items
-    db.query(models.CartItem).filter(models.CartItem.cart_id == cart.id).delete()
-    db.commit()
-    db.refresh(order)
+    return True
+
+
+def _restock(db: Session, product_id: int, quantity: int, sharded: bool):
+    if sharded:
+        shard = db.query(models.StockShard.shard).filter(models.StockShard.product_id == product_id).order_by(
+            func.random()
+        ).limit(1).scalar()
+        db.query(models.StockShard).filter(
+            models.StockShard.product_id == product_id, models.StockShard.shard == shard
+        ).update({models.StockShard.stock: models.StockShard.stock + quantity}, synchronize_session=False)
+    else:
+        db.query(models.Product).filter(models.Product.id == product_id, models.Product.stock.isnot(None)).update(
+            {models.Product.stock: models.Product.stock + quantity}, synchronize_session=False
+        )
+
+
+def set_stock(db: Session, product_id: int, stock: int = None, shards: int = None) -> schemas.StockLevel:
+    # Set a product's available stock (None stops tracking it), optionally
+    # split evenly over `shards` counters
+    Shard = models.StockShard
+    db.query(Shard).filter(Shard.product_id == product_id).delete(synchronize_session=False)
+    if shards and stock is not None:
+        base, extra = divmod(stock, shards)
+        db.execute(insert(Shard), [
+            {"product_id": product_id, "shard": i, "stock": base + (1 if i < extra else 0)} for i in range(shards)
+        ])
+        values = {"stock": None, "stock_shards": shards}
+    else:
+        values = {"stock": stock, "stock_shards": None}
+    db.query(models.Product).filter(models.Product.id == product_id).update(values, synchronize_session=False)
+    db.commit()
+    return get_stock(db, product_id)
+
+
+def get_stock(db: Session, product_id: int):
+    # Current stock level of a product (summing shards), or None if unknown
+    row = db.query(models.Product.stock, models.Product.stock_shards).filter(models.Product.id == product_id).first()
+    if row is None:
+        return None
+    stock = row.stock
+    if row.stock_shards:
+        stock = db.query(func.coalesce(func.sum(models.StockShard.stock), 0)).filter(
+            models.StockShard.product_id == product_id
+        ).scalar()
+    return schemas.StockLevel(product_id=product_id, stock=stock, shards=row.stock_shards)
+
+
+def extend_reservation(db: Session, order_id: int, seen: datetime, until: datetime):
+    # Move an unreleased order's reservation end from `seen` to `until`,
+    # capped at STOCK_RESERVATION_MAX_SECONDS after the order was placed so
+    # repeated checkout attempts can't hold its stock indefinitely.
+    # Conditional on `seen`, so of concurrent callers only one writes and
+    # all get the same stored value back. Returns the reservation end now in
+    # effect (possibly still `seen`), or None if the order was paid or
+    # released meanwhile.
+    created_at = db.query(models.Order.created_at).filter(models.Order.id == order_id).scalar()
+    if created_at is not None:
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        until = min(until, created_at + timedelta(seconds=STOCK_RESERVATION_MAX_SECONDS))
+    if until > seen:
+        db.query(models.Order).filter(
+            models.Order.id == order_id,
+            models.Order.reserved_until == seen,
+            models.Order.stock_released_at.is_(None),
+        ).update({"reserved_until": until}, synchronize_session=False)
+        db.commit()
+    return db.query(models.Order.reserved_until).filter(models.Order.id == order_id).scalar()
+
+
+def _retake_released_stock(db: Session, order_id: int) -> bool:
+    # Pay an unpaid order whose reservation was released, if its stock can
+    # be taken again. The claim locks the order row, so only one payment
+    # can retake it; on a shortfall the lines already taken are put back
+    # and the order is left released.
+    Order = models.Order
+    released_at = db.query(Order.stock_released_at).filter(
+        Order.id == order_id, or_(Order.paid.is_(False), Order.paid.is_(None))
+    ).scalar()
+    if released_at is None:
+        return False
+    claimed = db.query(Order).filter(Order.id == order_id, Order.stock_released_at == released_at).update(
+        {"paid": True, "stock_released_at": None}, synchronize_session=False
+    )
+    if not claimed:
+        return False
+    lines = (
+        db.query(models.OrderItem.product_id, models.OrderItem.quantity, models.Product.stock, models.Product.stock_shards)
+        .join(models.Product, models.Product.id == models.OrderItem.product_id)
+        .filter(models.OrderItem.order_id == order_id)
+        .all()
+    )
+    taken = []
+    for line in lines:
+        if line.stock_shards:
+            ok = _take_sharded(db, line.product_id, line.quantity)
+        elif line.stock is not None:
+            ok = db.query(models.Product).filter(
+                models.Product.id == line.product_id, models.Product.stock >= line.quantity
+            ).update({models.Product.stock: models.Product.stock - line.quantity}, synchronize_session=False) == 1
+        else:
+            continue
+        if not ok:
+            for done in taken:
+                _restock(db, done.product_id, done.quantity, bool(done.stock_shards))
+            db.query(Order).filter(Order.id == order_id).update(
+                {"paid": False, "stock_released_at": released_at}, synchronize_session=False
+            )
+            return False
+        taken.append(line)
+    return True
+
+
+def release_expired_reservations(db: Session, limit: int = 100) -> int:
+    # Return the stock of unpaid orders whose reservation has expired.
+    # Each order is claimed with a conditional UPDATE (so concurrent sweepers
+    # and a racing payment can't both win) and restocked in the same
+    # transaction. Returns the number of orders released.
+    now = datetime.utcnow()
+    expired = [
+        order_id for (order_id,) in db.query(models.Order.id)
+        .filter(models.Order.reserved_until < now)
+        .order_by(models.Order.reserved_until)
+        .limit(limit)
+    ]
+    db.rollback()
+    released = 0
+    for order_id in expired:
+        claimed = db.query(models.Order).filter(
+            models.Order.id == order_id,
+            models.Order.reserved_until < now,
+            or_(models.Order.paid.is_(False), models.Order.paid.is_(None)),
+        ).update({"reserved_until": None, "stock_released_at": now}, synchronize_session=False)
+        if claimed:
+            lines = (
+                db.query(models.OrderItem.product_id, models.OrderItem.quantity, models.Product.stock_shards)
+                .join(models.Product, models.Product.id == models.OrderItem.product_id)
+                .filter(models.OrderItem.order_id == order_id)
+                .all()
+            )
+            for line in lines:
+                _restock(db, line.product_id, line.quantity, bool(line.stock_shards))
+            released += 1
+        db.commit()
+    return released
+
+
+_order_lines = TypeAdapter(List[schemas.OrderItem])
+_order_adapter = TypeAdapter(schemas.Order)
+
+
+def _order_for_key(db: Session, cart: models.Cart, idempotency_key: str):
+    order = db.query(models.Order).filter(models.Order.idempotency_key == idempotency_key).first()
+    if order is not None and order.cart_id != cart.id:
+        raise ValueError("Idempotency-Key was already used for another cart")
     return order
 
 
-def get_order(db: Session, order_id: int):
-    # Retrieve an order by id
-    return db.query(models.Order).filter(models.Order.id == order_id).first()
+def get_order(db: Session, order_id: int, load_items: bool = False):
+    # Retrieve an order by id, optionally with its lines and their products
+    # loaded up front (three queries) for serializing `schemas.Order`
+    query = db.query(models.Order).filter(models.Order.id == order_id)
+    if load_items:
+        query = query.options(selectinload(models.Order.items).selectinload(models.OrderItem.product))
+    return query.first()
 
 
-def create_payment(db: Session, order: models.Order, amount: float, provider: str = "local") -> models.Payment:
-    # For demo purposes this records a completed payment and marks the order paid.
-    # Replace with real provider integration and webhooks in production.
-    p = models.Payment(order_id=order.id, amount=amount, provider=provider, status="completed")
-    order.paid = True
+# Order columns needed to render `schemas.Order` from the stored snapshot
+_ORDER_COLUMNS = (
+    models.Order.id,
+    models.Order.total_amount,
+    models.Order.paid,
+    models.Order.created_at,
+    models.Order.lines_json,
+)
+
+
+def _encode_order(row) -> bytes:
+    # Encode the order header and splice the stored lines in place of the
+    # empty `items` list (the last field of `schemas.Order`)
+    head = _order_adapter.dump_json(
+        schemas.Order(id=row.id, total_amount=row.total_amount, paid=bool(row.paid), created_at=row.created_at)
+    )
+    return head[: -len(b"[]}")] + row.lines_json.encode() + b"}"
+
+
+def _encode_orders_from_rows(db: Session, order_ids) -> dict:
+    # Orders placed before snapshots existed, rendered from their rows with
+    # lines and products eager-loaded for all of them at once
+    orders = (
+        db.query(models.Order)
+        .options(selectinload(models.Order.items).selectinload(models.OrderItem.product))
+        .filter(models.Order.id.in_(order_ids))
+        .all()
+    )
+    return {o.id: _order_adapter.dump_json(schemas.Order.model_validate(o)) for o in orders}
+
+
+def get_order_json(db: Session, order_id: int):
+    # Encoded `schemas.Order` for an order, or None. One primary-key read:
+    # the lines come from the snapshot stored at checkout, so they neither
+    # touch order_items/products nor change when products are edited later.
+    row = db.query(*_ORDER_COLUMNS).filter(models.Order.id == order_id).first()
+    if row is None:
+        return None
+    if row.lines_json is None:
+        return _encode_orders_from_rows(db, [order_id])[order_id]
+    return _encode_order(row)
+
+
+def list_user_orders(db: Session, user_id: int, limit: int = 20, after: str = None) -> bytes:
+    # Encoded `schemas.OrderPage` of a user's orders, newest first. Pages
+    # seek on (created_at, id) within the user via `ix_orders_user_created`,
+    # so each costs O(limit) however many orders the user has. The cursor
+    # holds only the last order's id; its (created_at, id) is read back in a
+    # subquery so the comparison is always between stored values.
+    query = db.query(*_ORDER_COLUMNS).filter(models.Order.user_id == user_id)
+    if after:
+        cursor = decode_cursor(after)
+        if "id" not in cursor:
+            raise ValueError("Invalid cursor")
+        last = (
+            select(models.Order.created_at, models.Order.id)
+            .where(models.Order.id == cursor["id"], models.Order.user_id == user_id)
+            .subquery()
+        )
+        last_created = select(last.c.created_at).scalar_subquery()
+        last_id = select(last.c.id).scalar_subquery()
+        query = query.filter(tuple_(models.Order.created_at, models.Order.id) < tuple_(last_created, last_id))
+    rows = query.order_by(models.Order.created_at.desc(), models.Order.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor({"id": rows[limit - 1].id}) if len(rows) > limit else None
+    rows = rows[:limit]
+    legacy_ids = [r.id for r in rows if r.lines_json is None]
+    legacy = _encode_orders_from_rows(db, legacy_ids) if legacy_ids else {}
+    items = b",".join(legacy[r.id] if r.lines_json is None else _encode_order(r) for r in rows)
+    return b'{"items":[' + items + b'],"next_cursor":' + json.dumps(next_cursor).encode() + b"}"
+
+
+def record_payment(db: Session, order_id: int, amount: float, provider: str = "local", reference: str = None):
+    # Flip the order to paid and record the payment, without committing.
+    # The conditional UPDATE is the idempotency guard: of any number of
+    # concurrent or repeated calls, only the one that flips `paid` records a
+    # completed payment; the rest get None. An order whose reservation was
+    # released is paid only if its stock can be taken again.
+    #
+    # A provider charge (one with a `reference`) is never dropped: when the
+    # order can't be paid (released and sold out, or already paid through
+    # another session) the payment is recorded with status "refund_required"
+    # for a refund or manual fulfilment. A reference seen before returns None.
+    if reference is not None and db.query(models.Payment.id).filter(models.Payment.reference == reference).first():
+        return None
+    flipped = db.query(models.Order).filter(
+        models.Order.id == order_id,
+        or_(models.Order.paid.is_(False), models.Order.paid.is_(None)),
+        models.Order.stock_released_at.is_(None),
+    ).update({"paid": True, "reserved_until": None}, synchronize_session=False)
+    status = "completed"
+    if not flipped and not _retake_released_stock(db, order_id):
+        if reference is None:
+            return None
+        status = "refund_required"
+    p = models.Payment(order_id=order_id, amount=amount, provider=provider, status=status, reference=reference)
     db.add(p)
-    db.add(order)
+    db.flush()
+    return p
+
+
+def create_payment(db: Session, order: models.Order, amount: float, provider: str = "local", reference: str = None):
+    # For demo purposes this records a completed payment and marks the order paid.
+    # Returns None if the order was already paid, or its stock reservation
+    # expired and the stock is gone. Provider payments arrive through the
+    # webhook inbox (see webhooks.py).
+    p = record_payment(db, order.id, amount, provider, reference)
+    if p is None:
+        db.rollback()
+        return None
     db.commit()
     db.refresh(p)
     return p
 
 
+def set_checkout_session(db: Session, order_id: int, session_id: str, url: str, expires_at: datetime):
+    # Remember the provider checkout session opened for an order
+    db.query(models.Order).filter(models.Order.id == order_id).update(
+        {
+            "checkout_session_id": session_id,
+            "checkout_session_url": url,
+            "checkout_session_expires_at": expires_at,
+        },
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def record_webhook_event(db: Session, event_id: str, event_type: str, payload: str) -> bool:
+    # Store a webhook delivery in the inbox for the background worker.
+    # Returns False if this event id was received before (a provider retry).
+    now = datetime.utcnow()
+    stmt = _upsert(db, models.WebhookEvent).values(
+        id=event_id,
+        type=event_type,
+        payload=payload,
+        status="pending",
+        attempts=0,
+        next_attempt_at=now,
+        received_at=now,
+    ).on_conflict_do_nothing(index_elements=["id"])
+    inserted = db.execute(stmt).rowcount == 1
+    db.commit()
+    return inserted
+
+
 def get_user_by_email(db: Session, email: str):
     # Helper to find a user by email
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def create_user(db: Session, user_in: schemas.UserCreate):
-    # Create a new user, hashing the provided password before persisting.
-    hashed = get_password_hash(user_in.password)
+# Authenticated-user snapshots, so protected routes don't query `users` on
+# every call. Entries live for USER_CACHE_TTL seconds and are dropped in this
+# process when the password is reset or the account deactivated; other
+# workers catch up when their entry expires.
+_user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "4096")), ttl=float(os.getenv("USER_CACHE_TTL", "30")))
+
+
+def user_cache_stats() -> dict:
+    return _user_cache.stats()
+
+
+def get_user_snapshot(db: Session, user_id: int = None, email: str = None):
+    # Cached `schemas.User` for a token's `uid` claim (by primary key) or,
+    # for tokens without one, its `sub` email. Returns None if not found.
+    key = ("id", user_id) if user_id is not None else ("email", email)
+    user = _user_cache.get(key)
+    if user is None:
+        if user_id is not None:
+            row = db.query(models.User).filter(models.User.id == user_id).first()
+        else:
+            row = get_user_by_email(db, email)
+        if row is None:
+            return None
+        user = schemas.User.model_validate(row)
+        _user_cache.set(key, user)
+    return user
+
+
+def invalidate_user(user: models.User):
+    _user_cache.pop(("id", user.id))
+    _user_cache.pop(("email", user.email))
+
+
+def deactivate_user(db: Session, user: models.User):
+    # Disable an account; cached snapshots are dropped so it stops authenticating
+    user.is_active = False
+    db.add(user)
+    db.commit()
+    invalidate_user(user)
+    return user
+
+
+def create_user(db: Session, user_in: schemas.UserCreate, hashed_password: str = None):
+    # Create a new user, hashing the provided password before persisting
+    # (unless the hash was already computed, e.g. on the hashing executor).
+    hashed = hashed_password or get_password_hash(user_in.password)
     user = models.User(email=user_in.email, hashed_password=hashed)
     db.add(user)
     db.commit()
@@ -146,7 +1003,7 @@ def verify_password_reset(db: Session, token: str):
     return pr
 
 
-def use_password_reset(db: Session, token: str, new_password: str):
+def use_password_reset(db: Session, token: str, new_password: str, hashed_password: str = None):
     # Apply a password reset: mark token used and update user's hashed password.
     pr = verify_password_reset(db, token)
     if not pr:
@@ -154,9 +1011,76 @@ def use_password_reset(db: Session, token: str, new_password: str):
     user = db.query(models.User).filter(models.User.id == pr.user_id).first()
     if not user:
         return None
-    user.hashed_password = get_password_hash(new_password)
+    user.hashed_password = hashed_password or get_password_hash(new_password)
     pr.used = True
     db.add(user)
     db.add(pr)
     db.commit()
+    invalidate_user(user)
     return user
+
+
+def update_password_hash(db: Session, user: models.User, hashed_password: str):
+    # Replace a stored hash with one using current settings (same password)
+    user.hashed_password = hashed_password
+    db.add(user)
+    db.commit()
+    return user
+
+
+# Async variants for `async def` routes. Each runs the sync implementation
+# above through `AsyncSession.run_sync`, so statements are awaited on the async
+# driver instead of blocking the event loop while the logic stays in one place.
+# Returned objects are fully loaded; touching an unloaded relationship on them
+# outside `run_sync` raises instead of lazy loading.
+
+
+async def create_product_async(db: AsyncSession, product_in: schemas.ProductCreate) -> models.Product:
+    return await db.run_sync(create_product, product_in)
+
+
+async def set_image_variants_async(db: AsyncSession, image_url: str, variants: dict) -> int:
+    return await db.run_sync(set_image_variants, image_url, variants)
+
+
+async def get_order_async(db: AsyncSession, order_id: int):
+    return await db.run_sync(get_order, order_id)
+
+
+async def create_payment_async(db: AsyncSession, order: models.Order, amount: float, provider: str = "local", reference: str = None):
+    return await db.run_sync(create_payment, order, amount, provider, reference)
+
+
+async def extend_reservation_async(db: AsyncSession, order_id: int, seen: datetime, until: datetime):
+    return await db.run_sync(extend_reservation, order_id, seen, until)
+
+
+async def set_checkout_session_async(db: AsyncSession, order_id: int, session_id: str, url: str, expires_at: datetime):
+    return await db.run_sync(set_checkout_session, order_id, session_id, url, expires_at)
+
+
+async def record_webhook_event_async(db: AsyncSession, event_id: str, event_type: str, payload: str) -> bool:
+    return await db.run_sync(record_webhook_event, event_id, event_type, payload)
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    return await db.run_sync(get_user_by_email, email)
+
+
+async def create_user_async(db: AsyncSession, user_in: schemas.UserCreate):
+    # bcrypt runs on the hashing executor, never inside `run_sync` (which
+    # executes on the event loop thread)
+    hashed = await get_password_hash_async(user_in.password)
+    return await db.run_sync(create_user, user_in, hashed)
+
+
+async def update_password_hash_async(db: AsyncSession, user: models.User, hashed_password: str):
+    return await db.run_sync(update_password_hash, user, hashed_password)
+
+
+async def use_password_reset_async(db: AsyncSession, token: str, new_password: str):
+    # Check the token before spending a hash on it
+    if not await db.run_sync(verify_password_reset, token):
+        return None
+    hashed = await get_password_hash_async(new_password)
+    return await db.run_sync(use_password_reset, token, new_password, hashed)
@@ -1,15 +1,132 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-# Database URL for local development using SQLite. Change to use PostgreSQL in production.
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app2.db"
+# Database URL from the environment (render.yaml sets DATABASE_URL), defaulting
+# to the local SQLite file for development. `postgres://` URLs as issued by
+# hosting providers are accepted and mapped to SQLAlchemy's `postgresql://`.
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app2.db")
+if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
+    SQLALCHEMY_DATABASE_URL = "postgresql://" + SQLALCHEMY_DATABASE_URL[len("postgres://"):]
+
+# SQLite connection profile. WAL lets readers proceed while a writer commits,
+# synchronous=NORMAL is durable in WAL mode with far fewer fsyncs, and the busy
+# timeout makes a second writer wait instead of failing with "database is
+# locked". Cache and mmap sizes let hot pages be served from memory.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+# Server database pool profile (PostgreSQL etc.). pre_ping drops connections
+# the server closed while idle; recycle retires them before proxies/firewalls do.
+POOL_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": True,
+}
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def make_engine(url: str, **kwargs):
+    """Create a sync engine with the profile matching the URL's backend."""
+    if _is_sqlite(url):
+        # check_same_thread=False: sessions are used from FastAPI's threadpool
+        new_engine = create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+        event.listen(new_engine, "connect", _set_sqlite_pragmas)
+        return new_engine
+    return create_engine(url, **{**POOL_OPTIONS, **kwargs})
+
+
+def make_async_engine(url: str, **kwargs):
+    """Async counterpart of `make_engine`; raises ImportError without the driver."""
+    if _is_sqlite(url):
+        new_engine = create_async_engine(to_async_url(url), **kwargs)
+        event.listen(new_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return new_engine
+    return create_async_engine(to_async_url(url), **{**POOL_OPTIONS, **kwargs})
 
-# Create the SQLAlchemy engine. For SQLite we need check_same_thread=False for multithreading.
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+# Async engine on the same database for `async def` routes, so their queries
+# are awaited instead of blocking the event loop. Uses aiosqlite for SQLite
+# and asyncpg for PostgreSQL; left as None if that driver is not installed.
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync database URL to the matching async driver URL."""
+    scheme, _, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+# Create the SQLAlchemy engine.
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
 # Session factory: create a new Session for each request via dependency.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+try:
+    async_engine = make_async_engine(SQLALCHEMY_DATABASE_URL)
+except ImportError:
+    async_engine = None
+
+# expire_on_commit=False: attributes of returned objects stay readable after
+# commit, where a lazy refresh would otherwise need an awaitable context.
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Optional read replica. Catalog GET routes take their session from
+# `get_read_db`, which uses READ_DATABASE_URL when set and the primary
+# otherwise. Locally this can be a second SQLite file (e.g.
+# READ_DATABASE_URL=sqlite:///./app1.db) refreshed from the primary with
+# `refresh_sqlite_replica()`.
+#
+# Only reads that tolerate replication lag go there: the catalog is already
+# served from caches that may be seconds old. Product lookups by id that miss
+# on the replica are retried on the primary, so a product is readable right
+# after it was created. Carts and orders are read back
+# by the client right after it wrote them, and the frontend calls the API
+# cross-site (so no cookie can mark a client as having just written), so
+# they are always read from the primary (`get_db`).
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+read_engine = make_engine(READ_DATABASE_URL) if READ_DATABASE_URL else None
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_engine else SessionLocal
+
+
+def pool_status() -> dict:
+    """Connection pool utilization of each engine (for health checks/metrics)."""
+    status = {}
+    engines = (("sync", engine), ("read", read_engine), ("async", async_engine.sync_engine if async_engine else None))
+    for name, eng in engines:
+        if eng is None:
+            continue
+        pool = eng.pool
+        status[name] = {
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        }
+    return status
+
 # Declarative base class for models to inherit from.
 Base = declarative_base()
 
@@ -26,6 +143,30 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """Dependency yielding a session for lag-tolerant reads (the catalog).
+
+    Uses the replica when one is configured, else the primary.
+    Usage: `db: Session = Depends(get_read_db)`.
+    """
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """Async counterpart of `get_db` yielding an `AsyncSession`.
+
+    Usage in async endpoints: `db: AsyncSession = Depends(get_async_db)`.
+    """
+    if async_engine is None:
+        raise RuntimeError("No async driver installed for this database (aiosqlite/asyncpg)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def init_db():
     """Initialize the DB schema (for development).
 
@@ -34,5 +175,46 @@ def init_db():
     """
     # Import models so they are registered with Base.metadata
     from . import models  # noqa: F401
+    from .search import init_search
 
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so nullable columns and
+    # indexes added to models later are created here for databases that
+    # predate them.
+    _add_missing_columns()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    init_search(engine)
+
+
+def _add_missing_columns():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                conn.exec_driver_sql(ddl)
+                if column.server_default is not None:
+                    # SQLite can't ALTER in a non-constant default such as
+                    # now(), so existing rows get it once here instead
+                    conn.execute(table.update().values({column.name: column.server_default.arg}))
+
+
+def refresh_sqlite_replica():
+    """Copy the primary SQLite database onto the replica file (local testing).
+
+    Uses SQLite's online backup API, so it is safe while the app is running.
+    """
+    if read_engine is None or not (_is_sqlite(SQLALCHEMY_DATABASE_URL) and _is_sqlite(READ_DATABASE_URL)):
+        raise RuntimeError("refresh_sqlite_replica needs SQLite DATABASE_URL and READ_DATABASE_URL")
+    src = engine.raw_connection()
+    dst = read_engine.raw_connection()
+    try:
+        src.driver_connection.backup(dst.driver_connection)
+    finally:
+        dst.close()
+        src.close()
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
@@ -8,6 +10,8 @@ from .security import decode_token
 
 # OAuth2 scheme that reads the ``Authorization: Bearer <token>`` header
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
+# Same, but lets anonymous requests through (token is None)
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token", auto_error=False)
 
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -19,17 +23,38 @@ credentials_exception = HTTPException(
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """Dependency to retrieve the currently authenticated user from a JWT.
 
-    Raises a 401 HTTPException if the token is invalid or the user does not exist.
-    Use in routes as `user: User = Depends(get_current_user)` to protect endpoints.
+    Raises a 401 HTTPException if the token is invalid, the user does not
+    exist or is inactive. Returns a cached `schemas.User` snapshot (looked up
+    by the token's `uid` claim when present, else by email) rather than an ORM
+    object, so most calls do not touch the database.
+    Use in routes as `user: schemas.User = Depends(get_current_user)` to protect endpoints.
     """
     try:
         payload = decode_token(token)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
+        uid = payload.get("uid")
+        user_id = int(uid) if uid is not None else None
     except Exception:
         raise credentials_exception
-    user = crud.get_user_by_email(db, email)
-    if not user:
+    user = crud.get_user_snapshot(db, user_id=user_id, email=email)
+    if not user or not user.is_active:
         raise credentials_exception
     return user
+
+
+def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme), db: Session = Depends(get_db)):
+    """Like `get_current_user`, but returns None for anonymous requests.
+
+    A token that is invalid (expired, or signed before a SECRET_KEY change)
+    or names an unknown/inactive user also counts as anonymous: the frontend
+    sends its stored token on every request and treats any 401 as "log in
+    again", which would lock guests out of routes that don't need auth.
+    """
+    if token is None:
+        return None
+    try:
+        return get_current_user(token, db)
+    except HTTPException:
+        return None
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it originals are served as-is
+    Image = None
+
+# Derivative images for uploads. Resizing and WebP encoding are CPU-bound, so
+# they run in a process pool after the upload response has been sent, and the
+# resulting URLs are recorded on every product using the original
+# (`Product.image_variants`). Output names derive from the content-addressed
+# original (`<sha256>_<variant>.webp`), so each image is processed once no
+# matter how many times it is uploaded.
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> longest side in pixels (None keeps the original size)
+VARIANTS = {"thumb": 320, "medium": 800, "full": None}
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+_pool = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def make_variants(src_path: str) -> dict:
+    """Write the WebP derivatives of `src_path` next to it.
+
+    Returns a mapping of variant name to file name. Variants that already
+    exist are not regenerated. Runs in a worker process.
+    """
+    directory, name = os.path.split(src_path)
+    stem = os.path.splitext(name)[0]
+    variants = {}
+    with Image.open(src_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+        for variant, size in VARIANTS.items():
+            filename = f"{stem}_{variant}.webp"
+            dest = os.path.join(directory, filename)
+            if not os.path.exists(dest):
+                out = image.copy()
+                if size:
+                    out.thumbnail((size, size))
+                tmp = dest + ".part"
+                out.save(tmp, "WEBP", quality=WEBP_QUALITY)
+                os.replace(tmp, dest)
+            variants[variant] = filename
+    return variants
+
+
+async def generate_variants(src_path: str) -> dict:
+    """Build the derivatives of `src_path` in the process pool.
+
+    Returns an empty mapping when Pillow is unavailable or the image cannot
+    be decoded (logged, so missing variants can be traced).
+    """
+    if Image is None:
+        logger.warning("Pillow is not installed; no image variants for %s", src_path)
+        return {}
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), make_variants, src_path)
+    except Exception:
+        logger.exception("could not build image variants for %s", src_path)
+        return {}
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
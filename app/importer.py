@@ -0,0 +1,148 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+
+# Bulk product import from CSV or JSON Lines.
+#
+# Input is read one row at a time, validated with `schemas.ProductCreate` and
+# written in batches of IMPORT_BATCH_SIZE rows per transaction (executemany
+# upserts keyed by `sku`, see `crud.upsert_products`), so memory stays
+# constant whatever the file size. Invalid rows are reported by line number
+# and skipped; only the first MAX_REPORTED_ERRORS are listed. When a batch
+# holds several rows for one sku the last one wins and the earlier ones are
+# counted as `superseded`, so rows == imported + failed + superseded.
+#
+# `stock` sets the units available; an empty cell or missing column leaves an
+# existing product's stock as it is (products whose stock is sharded keep
+# their shard counters, set them with PUT /products/{id}/stock).
+#
+#   CLI:  python -m app.importer catalog.csv [--format jsonl] [--batch-size 5000]
+#   API:  POST /products/import (multipart file)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+MAX_REPORTED_ERRORS = 100
+FIELDS = ("name", "price", "image_url", "sku", "stock")
+
+
+def detect_format(filename: str = None, content_type: str = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")) or (content_type or "").endswith(("jsonl", "ndjson", "json")):
+        return "jsonl"
+    return "csv"
+
+
+def iter_rows(stream, fmt: str = "csv"):
+    """Yield `(line_number, raw_row)` from a text stream.
+
+    `raw_row` is a dict, or an Exception for lines that could not be parsed.
+    """
+    if fmt == "jsonl":
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+                continue
+            yield line_no, row if isinstance(row, dict) else ValueError("expected a JSON object")
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def _clean(row: dict) -> dict:
+    # Empty CSV cells mean "not set" for optional fields
+    return {k: (None if v == "" else v) for k, v in row.items() if k in FIELDS}
+
+
+def import_products(db: Session, stream, fmt: str = "csv", batch_size: int = IMPORT_BATCH_SIZE) -> schemas.ImportReport:
+    """Validate and write every row of `stream`; returns an `ImportReport`."""
+    started = time.perf_counter()
+    report = {"rows": 0, "imported": 0, "failed": 0, "superseded": 0, "batches": 0, "errors": []}
+
+    def fail(line_no, error):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append(schemas.ImportRowError(line=line_no, error=str(error)))
+
+    def flush(batch):
+        report["batches"] += 1
+        # Fold rows sharing a sku here rather than in the upsert, so the
+        # dropped ones are counted and the one-row retries below see the
+        # same rows as the batch write
+        latest = {}
+        for i, (_, row) in enumerate(batch):
+            if row.get("sku"):
+                latest[row["sku"]] = i
+        kept = [(line_no, row) for i, (line_no, row) in enumerate(batch) if not row.get("sku") or latest[row["sku"]] == i]
+        report["superseded"] += len(batch) - len(kept)
+        batch = kept
+        try:
+            report["imported"] += crud.upsert_products(db, [row for _, row in batch])
+        except DBAPIError:
+            # Isolate the offending rows: retry the batch one row at a time
+            db.rollback()
+            for line_no, row in batch:
+                try:
+                    report["imported"] += crud.upsert_products(db, [row])
+                except DBAPIError as e:
+                    db.rollback()
+                    fail(line_no, e.orig)
+
+    batch = []
+    try:
+        for line_no, raw in iter_rows(stream, fmt):
+            report["rows"] += 1
+            if isinstance(raw, Exception):
+                fail(line_no, raw)
+                continue
+            try:
+                product = schemas.ProductCreate.model_validate(_clean(raw))
+            except ValidationError as e:
+                fail(line_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+            batch.append((line_no, product.model_dump()))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        crud.invalidate_catalog()
+    return schemas.ImportReport(seconds=round(time.perf_counter() - started, 3), **report)
+
+
+def main(argv=None):
+    from .db import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Bulk import products from CSV or JSON Lines")
+    parser.add_argument("path", help="input file, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    init_db()
+    fmt = args.format or detect_format(args.path)
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="") if args.path == "-" else open(
+        args.path, encoding="utf-8-sig", newline=""
+    )
+    with stream, SessionLocal() as db:
+        report = import_products(db, stream, fmt, args.batch_size)
+    print(report.model_dump_json(indent=2))
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
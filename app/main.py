@@ -1,9 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import time
 import uuid
-from fastapi.staticfiles import StaticFiles
-from .db import init_db
+from . import crud, images, metrics, payment_providers, reservations, webhooks
+from .db import async_engine, engine, init_db, pool_status, read_engine
+from .security import hashing_stats
+from .static_files import CachedStaticFiles
 from .routers import products, cart, orders, payments, auth
 
 # Core FastAPI application instance
@@ -29,6 +33,32 @@ app.add_middleware(
 )
 
 
+# Per-request DB query count and time (see metrics.py)
+for _engine in (engine, read_engine, async_engine.sync_engine if async_engine else None):
+    if _engine is not None:
+        metrics.instrument_engine(_engine)
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    # Outermost middleware: latency by route template, in-flight count and
+    # the DB share of each request, exposed at /metrics. The request's
+    # `RequestStats` is on `request.state.db_stats` and fills in as it runs
+    stats = metrics.begin_request()
+    request.state.db_stats = stats
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        seconds = time.perf_counter() - start
+        route = request.scope.get("route")
+        metrics.end_request(request.method, route.path if route else "unmatched", status, seconds, stats)
+    if metrics.SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(stats, seconds)
+    return response
+
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -41,7 +71,8 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Mount the static directory
 # This makes files in /static accessible at http://localhost:8000/static
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# with cache headers, ETags and precompressed variants (see static_files.py)
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 
 
 
@@ -59,7 +90,54 @@ def on_startup():
     init_db()
 
 
+@app.on_event("startup")
+async def start_background_workers():
+    # Applies stored payment webhook events (webhooks.py) and releases stock
+    # held by abandoned checkouts (reservations.py)
+    webhooks.start()
+    reservations.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await webhooks.stop()
+    await reservations.stop()
+    await payment_providers.close_provider()
+    images.shutdown()
+
+
 @app.get("/")
 def read_root():
     # Simple root endpoint useful for quick health checks.
     return {"message": "E-Commerce API (FastAPI)"}
+
+
+@app.get("/health")
+def health():
+    # Liveness plus DB connection pool utilization
+    return {"status": "ok", "db_pool": pool_status()}
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # Prometheus text exposition of request, DB pool, cache and hashing metrics
+    pools = pool_status()
+    caches = {**crud.catalog_cache_stats(), "users": crud.user_cache_stats()}
+    hashing = hashing_stats()
+    extra = {
+        f"db_pool_{field}": ("gauge", f"Connection pool {field.replace('_', ' ')}.", [
+            ({"engine": name}, status[field]) for name, status in pools.items()
+        ])
+        for field in ("size", "checked_out", "checked_in", "overflow")
+    }
+    extra["cache_size"] = ("gauge", "In-process cache entries.", [({"cache": name}, s["size"]) for name, s in caches.items()])
+    for field in ("hits", "misses"):
+        extra[f"cache_{field}_total"] = ("counter", f"In-process cache {field}.", [
+            ({"cache": name}, s[field]) for name, s in caches.items()
+        ])
+    for field, kind in (("workers", "gauge"), ("in_flight", "gauge"), ("queued", "gauge"), ("completed", "counter"),
+                        ("failed", "counter"), ("rejected", "counter"), ("queue_seconds", "counter"),
+                        ("hash_seconds", "counter")):
+        name = f"password_hashing_{field}" + ("_total" if kind == "counter" else "")
+        extra[name] = (kind, f"Password hashing executor {field.replace('_', ' ')}.", [({}, hashing[field])])
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,170 @@
+import os
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# Request metrics in Prometheus text format.
+#
+# `main.py`'s middleware times every request by route template (not raw
+# path, to keep label cardinality bounded) and tracks in-flight requests.
+# SQLAlchemy cursor events on each engine add the query count and time spent
+# in the database to the current request's `RequestStats`, found through a
+# context variable (copied into threadpool workers and the async engine's
+# greenlets), so a slow route can be split into DB time and Python time.
+# Routes and inner middleware can read the running totals from
+# `request.state.db_stats`.
+# With SERVER_TIMING=1 the same numbers are sent as a `Server-Timing` header.
+#
+# Values are per process; Prometheus sums them across workers.
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+class _Route:
+    __slots__ = ("buckets", "count", "sum", "queries", "db_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Only touched from the event loop thread (middleware), so unlocked
+_routes = {}
+_statuses = {}
+_in_flight = 0
+
+
+def begin_request() -> RequestStats:
+    global _in_flight
+    _in_flight += 1
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def end_request(method: str, route: str, status: int, seconds: float, stats: RequestStats):
+    global _in_flight
+    _in_flight -= 1
+    key = (method, route)
+    entry = _routes.get(key)
+    if entry is None:
+        entry = _routes[key] = _Route()
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            entry.buckets[i] += 1
+    entry.count += 1
+    entry.sum += seconds
+    entry.queries += stats.queries
+    entry.db_seconds += stats.db_seconds
+    status_key = (method, route, status)
+    _statuses[status_key] = _statuses.get(status_key, 0) + 1
+
+
+def server_timing(stats: RequestStats, seconds: float) -> str:
+    db_ms = stats.db_seconds * 1000
+    return (
+        f'db;dur={db_ms:.1f};desc="{stats.queries} queries", '
+        f"app;dur={max(seconds * 1000 - db_ms, 0):.1f}, total;dur={seconds * 1000:.1f}"
+    )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """Count queries and DB time of `engine` (a sync `Engine`) per request."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    inner = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + inner + "}" if inner else ""
+
+
+def render(extra: dict = None) -> str:
+    """Render all metrics in Prometheus text exposition format.
+
+    `extra` maps a metric name to `(type, help, [(labels_dict, value), ...])`
+    for values owned by other modules (pools, caches, hashing, ...).
+    """
+    lines = [
+        "# HELP http_requests_in_flight Requests currently being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {_in_flight}",
+        "# HELP http_requests_total Completed requests.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), count in sorted(_statuses.items()):
+        lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+    lines += [
+        "# HELP http_request_duration_seconds Request latency.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    routes = sorted(_routes.items())
+    for (method, route), entry in routes:
+        for bound, count in zip(BUCKETS, entry.buckets):
+            lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}")
+        lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le='+Inf')} {entry.count}")
+        lines.append(f"http_request_duration_seconds_sum{_labels(method=method, route=route)} {entry.sum}")
+        lines.append(f"http_request_duration_seconds_count{_labels(method=method, route=route)} {entry.count}")
+
+    lines += [
+        "# HELP http_request_db_queries_total Database queries issued while serving requests.",
+        "# TYPE http_request_db_queries_total counter",
+    ]
+    for (method, route), entry in routes:
+        lines.append(f"http_request_db_queries_total{_labels(method=method, route=route)} {entry.queries}")
+    lines += [
+        "# HELP http_request_db_seconds_total Time spent in database queries while serving requests.",
+        "# TYPE http_request_db_seconds_total counter",
+    ]
+    for (method, route), entry in routes:
+        lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {entry.db_seconds}")
+
+    for name, (kind, help_text, samples) in (extra or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is not None:
+                lines.append(f"{name}{_labels(**labels)} {value}")
+    return "\n".join(lines) + "\n"
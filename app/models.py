@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, func
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, Index, JSON, Text, func
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -7,14 +7,49 @@ class Product(Base):
     """Represents a product available for purchase.
 
     Fields:
-    - `name`, `description`, `price`, `stock`, `created_at`
+    - `name`, `price`, `image_url`, `created_at`
+    - `image_variants`: URLs of derived images of `image_url`
+    - `sku`: optional external key, unique when set
+    - `stock`: units available, or NULL when stock is not tracked
+    - `stock_shards`: when set, stock is split across that many
+      `StockShard` rows (for very hot items) and `stock` is unused
     """
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ux_products_sku", "sku", unique=True),
+        # Listing sort orders (see `crud.PRODUCT_SORTS`); id breaks ties
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        Index("ix_products_created_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
+    name = Column(String)
     price = Column(Float)  # Fixed: SQLAlchemy uses 'Float' with a capital 'F'
     image_url = Column(String, nullable=True)
+    # External catalog key; bulk imports upsert on it
+    sku = Column(String, nullable=True)
+    # Derived images of `image_url` ({"thumb": url, ...}); filled in after upload
+    image_variants = Column(JSON, nullable=True)
+    stock = Column(Integer, nullable=True)
+    stock_shards = Column(Integer, nullable=True)
+    # `default` too: tables migrated by `db._add_missing_columns` lack the
+    # server default, and a NULL here would drop rows from `newest` paging
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
+
+
+class StockShard(Base):
+    """One slice of a sharded product's stock.
+
+    Checkouts decrement a random shard, so concurrent buyers of the same
+    product mostly lock different rows. Total stock is the sum of shards.
+    """
+    __tablename__ = "stock_shards"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    stock = Column(Integer, nullable=False, default=0)
+
 
 class User(Base):
     """Represents a user account.
@@ -39,17 +74,26 @@ class Cart(Base):
     items when a cart is deleted.
     """
     __tablename__ = "carts"
+    __table_args__ = (Index("ix_carts_user_id", "user_id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # Bumped at the start of every checkout; the UPDATE row-locks the cart so
+    # concurrent checkouts of one cart run one after the other
+    version = Column(Integer, nullable=True, default=0)
     items = relationship("CartItem", cascade="all, delete-orphan", back_populates="cart")
     user = relationship("User", back_populates="carts")
 
 
 class CartItem(Base):
-    """An item in a `Cart` linking to a `Product` with a quantity."""
+    """An item in a `Cart` linking to a `Product` with a quantity.
+
+    A cart holds at most one line per product; adding the same product again
+    bumps the quantity via an upsert on `ux_cart_items_cart_product`.
+    """
     __tablename__ = "cart_items"
+    __table_args__ = (Index("ux_cart_items_cart_product", "cart_id", "product_id", unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     cart_id = Column(Integer, ForeignKey("carts.id", ondelete="CASCADE"))
@@ -61,14 +105,36 @@ class CartItem(Base):
 
 
 class Order(Base):
-    """Represents a completed order created from a cart's items."""
+    """Represents a completed order created from a cart's items.
+
+    `idempotency_key` is the client's Idempotency-Key header from checkout;
+    retries with the same key return this order instead of creating another.
+    `checkout_session_*` cache the provider's open checkout session so it is
+    reused until it expires. `lines_json` is the encoded list of lines, each
+    with a copy of its product as purchased, written once at checkout (NULL
+    for orders that predate it).
+    """
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ux_orders_idempotency_key", "idempotency_key", unique=True),
+        # Order history: a user's orders newest first (`crud.list_user_orders`)
+        Index("ix_orders_user_created", "user_id", "created_at", "id"),
+        Index("ix_orders_reserved_until", "reserved_until"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     total_amount = Column(Float, nullable=False)
     paid = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    cart_id = Column(Integer, ForeignKey("carts.id"), nullable=True)
+    idempotency_key = Column(String, nullable=True)
+    checkout_session_id = Column(String, nullable=True)
+    checkout_session_url = Column(String, nullable=True)
+    checkout_session_expires_at = Column(DateTime, nullable=True)
+    lines_json = Column(Text, nullable=True)
+    reserved_until = Column(DateTime, nullable=True)
+    stock_released_at = Column(DateTime, nullable=True)
     items = relationship("OrderItem", cascade="all, delete-orphan", back_populates="order")
     user = relationship("User", back_populates="orders")
 
@@ -76,6 +142,7 @@ class Order(Base):
 class OrderItem(Base):
     """An item line within an Order."""
     __tablename__ = "order_items"
+    __table_args__ = (Index("ix_order_items_order_id", "order_id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"))
@@ -91,15 +158,21 @@ class Payment(Base):
     """Records a payment associated with an `Order`.
 
     `provider` is a string identifying the payment gateway; `status` tracks
-    payment state (e.g. pending, completed).
+    payment state (e.g. pending, completed). `reference` is the provider's id
+    for the charge (e.g. the Stripe checkout session), unique when set.
     """
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ux_payments_reference", "reference", unique=True),
+        Index("ix_payments_order_id", "order_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"))
     amount = Column(Float, nullable=False)
     provider = Column(String, default="local")
     status = Column(String, default="pending")
+    reference = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -114,3 +187,33 @@ class PasswordReset(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User")
+
+
+class CacheVersion(Base):
+    """A named counter bumped whenever the data behind an in-process cache
+    changes, so other workers notice and drop their copies."""
+    __tablename__ = "cache_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class WebhookEvent(Base):
+    """Inbox of payment provider webhook events, keyed by the provider's event id.
+
+    Deliveries are stored and acknowledged immediately; `webhooks.process_due`
+    applies them later. `status` is pending, processed or failed; a pending
+    event is retried once `next_attempt_at` has passed.
+    """
+    __tablename__ = "webhook_events"
+    __table_args__ = (Index("ix_webhook_events_due", "status", "next_attempt_at"),)
+
+    id = Column(String, primary_key=True)
+    type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text, nullable=True)
+    received_at = Column(DateTime, nullable=False)
+    processed_at = Column(DateTime, nullable=True)
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import httpx
+import stripe
+from dotenv import load_dotenv
+
+# Payment provider clients used by the checkout-session endpoint.
+#
+# `get_provider()` returns the provider named by PAYMENT_PROVIDER:
+#
+# - "stripe" (default): Stripe's async API over one shared httpx
+#   AsyncClient, so calls never block the event loop and reuse keep-alive
+#   connections. Connect/read timeouts and network retries are configurable.
+# - "fake": returns made-up sessions without any network I/O, optionally
+#   after FAKE_PROVIDER_LATENCY seconds, for local runs and benchmarks.
+#
+# Providers take the amount in cents and an idempotency key, so concurrent
+# requests for the same order converge on one provider session. Every
+# request under one key must send identical parameters (Stripe rejects a
+# reused key with different ones), so nothing here depends on the clock:
+# `expires_at` comes from the caller, or is left to the provider's default.
+
+load_dotenv()
+
+PAYMENT_PROVIDER = os.getenv("PAYMENT_PROVIDER", "stripe")
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "3"))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", "10"))
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+# Lifetime of a session created without `expires_at` (Stripe's default)
+DEFAULT_SESSION_TTL = 24 * 60 * 60
+FAKE_PROVIDER_LATENCY = float(os.getenv("FAKE_PROVIDER_LATENCY", "0"))
+
+CHECKOUT_SUCCESS_URL = os.getenv(
+    "CHECKOUT_SUCCESS_URL", "https://e-commerce-store-wine-one.vercel.app/success?session_id={CHECKOUT_SESSION_ID}"
+)
+CHECKOUT_CANCEL_URL = os.getenv("CHECKOUT_CANCEL_URL", "https://e-commerce-store-wine-one.vercel.app/cancel")
+
+
+class CheckoutSession(NamedTuple):
+    id: str
+    url: str
+    expires_at: datetime  # naive UTC
+
+
+def _utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(int(timestamp), timezone.utc).replace(tzinfo=None)
+
+
+class StripeProvider:
+    """Creates Stripe Checkout sessions through Stripe's async client."""
+
+    name = "stripe"
+
+    def __init__(self, api_key: str = None):
+        timeout = httpx.Timeout(STRIPE_READ_TIMEOUT, connect=STRIPE_CONNECT_TIMEOUT)
+        self._http = stripe.HTTPXClient(timeout=timeout)
+        self._client = stripe.StripeClient(
+            api_key or os.getenv("STRIPE_SECRET_KEY") or "",
+            http_client=self._http,
+            max_network_retries=STRIPE_MAX_RETRIES,
+        )
+
+    async def create_checkout_session(
+        self, order_id: int, amount_cents: int, idempotency_key: str, expires_at: datetime = None
+    ) -> CheckoutSession:
+        params = {
+            "payment_method_types": ["card"],
+            "line_items": [{
+                "price_data": {
+                    "currency": "usd",
+                    "product_data": {"name": f"Order #{order_id}"},
+                    "unit_amount": amount_cents,
+                },
+                "quantity": 1,
+            }],
+            "mode": "payment",
+            "success_url": CHECKOUT_SUCCESS_URL,
+            "cancel_url": CHECKOUT_CANCEL_URL,
+            # Links the Stripe payment to the DB order (see webhooks.py)
+            "metadata": {"order_id": str(order_id)},
+        }
+        if expires_at is not None:
+            params["expires_at"] = int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+        session = await self._client.v1.checkout.sessions.create_async(
+            params=params, options={"idempotency_key": idempotency_key}
+        )
+        return CheckoutSession(session.id, session.url, _utc(session.expires_at))
+
+    async def close(self):
+        await self._http.close_async()
+
+
+class FakeProvider:
+    """Provider stand-in that never leaves the process."""
+
+    name = "fake"
+
+    def __init__(self, latency: float = FAKE_PROVIDER_LATENCY):
+        self.latency = latency
+        self._sessions = {}
+
+    async def create_checkout_session(
+        self, order_id: int, amount_cents: int, idempotency_key: str, expires_at: datetime = None
+    ) -> CheckoutSession:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        session = self._sessions.get(idempotency_key)
+        if session is None:
+            session_id = f"cs_fake_{uuid.uuid4().hex}"
+            session = CheckoutSession(
+                session_id,
+                f"https://checkout.invalid/pay/{session_id}",
+                _utc(expires_at.replace(tzinfo=timezone.utc).timestamp() if expires_at else time.time() + DEFAULT_SESSION_TTL),
+            )
+            self._sessions[idempotency_key] = session
+        return session
+
+    async def close(self):
+        pass
+
+
+PROVIDERS = {"stripe": StripeProvider, "fake": FakeProvider}
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        try:
+            _provider = PROVIDERS[PAYMENT_PROVIDER]()
+        except KeyError:
+            raise RuntimeError(f"Unknown PAYMENT_PROVIDER {PAYMENT_PROVIDER!r}") from None
+    return _provider
+
+
+async def close_provider():
+    global _provider
+    if _provider is not None:
+        await _provider.close()
+        _provider = None
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+from . import crud
+from .db import SessionLocal
+
+# Background sweeper returning the stock held by abandoned checkouts: unpaid
+# orders whose reservation (`Order.reserved_until`) has passed are released
+# by `crud.release_expired_reservations`. Safe to run in every app process.
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_SWEEPER = os.getenv("RESERVATION_SWEEPER", "1") != "0"
+RESERVATION_SWEEP_SECONDS = float(os.getenv("RESERVATION_SWEEP_SECONDS", "60"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "100"))
+
+
+def sweep() -> int:
+    """Release every expired reservation. Returns the number released."""
+    released = 0
+    with SessionLocal() as db:
+        while True:
+            batch = crud.release_expired_reservations(db, RESERVATION_SWEEP_BATCH)
+            released += batch
+            if batch < RESERVATION_SWEEP_BATCH:
+                return released
+
+
+_task = None
+
+
+async def _run():
+    while True:
+        try:
+            released = await run_in_threadpool(sweep)
+            if released:
+                logger.info("released stock of %s expired order(s)", released)
+        except Exception:
+            logger.exception("reservation sweep failed")
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+
+
+def start():
+    global _task
+    if RESERVATION_SWEEPER and _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,49 @@
+import json
+from functools import lru_cache
+
+from pydantic import TypeAdapter
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+# Fast JSON response path, opted into per route.
+#
+# By default FastAPI validates a route's return value against its
+# `response_model` (re-reading every ORM attribute), converts the result to
+# plain Python objects and encodes that with `json.dumps`. Routes on the hot
+# path skip all of that by returning `json_response(...)`: values that are
+# already validated snapshots are serialized straight to bytes by a prebuilt
+# pydantic `TypeAdapter` (Rust), and plain dicts/lists by orjson. Keep the
+# route's `response_model` so the OpenAPI schema stays accurate; FastAPI does
+# not re-validate a returned `Response`.
+
+
+@lru_cache(maxsize=None)
+def adapter(tp) -> TypeAdapter:
+    """Cached `TypeAdapter` for `tp` (building one compiles a serializer)."""
+    return TypeAdapter(tp)
+
+
+def dumps(value) -> bytes:
+    """Encode plain JSON-compatible data."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
+
+
+def json_response(value, tp=None, status_code: int = 200, headers: dict = None) -> FastJSONResponse:
+    """Serialize `value` (as type `tp`, when given) into a `FastJSONResponse`."""
+    body = adapter(tp).dump_json(value) if tp is not None else dumps(value)
+    return FastJSONResponse(body, status_code=status_code, headers=headers)
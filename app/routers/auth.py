@@ -2,33 +2,53 @@ from datetime import timedelta
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from .. import crud, schemas
-from ..db import get_db
-from ..security import verify_password, create_access_token
+from ..db import get_async_db, get_db
+from ..security import HashingBusy, create_access_token, verify_and_update_async
 
 router = APIRouter()
 
+# Register, login and reset are async so bcrypt runs on the dedicated hashing
+# executor (see security.py) without tying up the threadpool serving sync routes.
+
+hashing_busy = HTTPException(status_code=503, detail="Password service busy, retry shortly", headers={"Retry-After": "1"})
+
 
 @router.post("/register", response_model=schemas.User)
-def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user_in: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user. Returns the created user (without password)."""
-    existing = crud.get_user_by_email(db, user_in.email)
+    existing = await crud.get_user_by_email_async(db, user_in.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = crud.create_user(db, user_in)
+    try:
+        user = await crud.create_user_async(db, user_in)
+    except HashingBusy:
+        raise hashing_busy
     return user
 
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    """Obtain a JWT access token using OAuth2 password flow."""
-    user = crud.get_user_by_email(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    """Obtain a JWT access token using OAuth2 password flow.
+
+    Hashes made with outdated settings are upgraded on successful login.
+    """
+    user = await crud.get_user_by_email_async(db, form_data.username)
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    try:
+        valid, new_hash = await verify_and_update_async(form_data.password, user.hashed_password)
+    except HashingBusy:
+        raise hashing_busy
+    if not valid:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        await crud.update_password_hash_async(db, user, new_hash)
     access_token_expires = timedelta(minutes=60 * 24)
-    token = create_access_token({"sub": user.email}, expires_delta=access_token_expires)
+    token = create_access_token({"sub": user.email, "uid": user.id}, expires_delta=access_token_expires)
     return {"access_token": token, "token_type": "bearer"}
 
 
@@ -52,13 +72,16 @@ def forgot_password(payload: dict, db: Session = Depends(get_db)):
 
 
 @router.post("/reset-password")
-def reset_password(payload: dict, db: Session = Depends(get_db)):
+async def reset_password(payload: dict, db: AsyncSession = Depends(get_async_db)):
     """Consume a reset token and set a new password for the user."""
     token = payload.get("token")
     new_password = payload.get("new_password")
     if not token or not new_password:
         raise HTTPException(status_code=400, detail="token and new_password required")
-    user = crud.use_password_reset(db, token, new_password)
+    try:
+        user = await crud.use_password_reset_async(db, token, new_password)
+    except HashingBusy:
+        raise hashing_busy
     if not user:
         raise HTTPException(status_code=400, detail="invalid or expired token")
     return {"message": "password reset successful"}
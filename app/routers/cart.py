@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlalchemy.orm import Session
 from .. import crud, schemas
 from ..db import get_db
+from ..deps import get_optional_user
+from ..responses import FastJSONResponse
 
 router = APIRouter()
 
 
 @router.post("/", response_model=schemas.Cart)
-def create_cart(db: Session = Depends(get_db)):
-    """Create a new cart. Returns the created `Cart` with its id."""
-    return crud.create_cart(db)
+def create_cart(db: Session = Depends(get_db), user: Optional[schemas.User] = Depends(get_optional_user)):
+    """Create a new cart. Returns the created `Cart` with its id.
+
+    Carts created with a bearer token belong to that user.
+    """
+    return crud.create_cart(db, user_id=user.id if user else None)
 
 
 @router.get("/{cart_id}", response_model=schemas.Cart)
@@ -24,19 +31,35 @@ def get_cart(cart_id: int, db: Session = Depends(get_db)):
 @router.post("/{cart_id}/items", response_model=schemas.CartItem)
 def add_item(cart_id: int, payload: schemas.CartItemCreate, db: Session = Depends(get_db)):
     """Add an item to the cart. If the item exists, increases quantity."""
-    c = crud.get_cart(db, cart_id)
+    c = crud.get_cart(db, cart_id, load_items=False)
     if not c:
         raise HTTPException(status_code=404, detail="Cart not found")
-    p = crud.get_product(db, payload.product_id)
+    p = crud.get_product_cached(db, payload.product_id)
     if not p:
         raise HTTPException(status_code=404, detail="Product not found")
     return crud.add_item_to_cart(db, c, p, payload.quantity)
 
 
+@router.post("/{cart_id}/items/batch", response_model=schemas.Cart)
+def update_items(cart_id: int, payload: schemas.CartBatchUpdate, db: Session = Depends(get_db)):
+    """Apply many line changes (increment, set, remove) in one transaction.
+
+    All products are validated up front; if any is unknown nothing changes.
+    Returns the updated cart.
+    """
+    c = crud.get_cart(db, cart_id, load_items=False)
+    if not c:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    try:
+        return crud.apply_cart_updates(db, c, payload.items)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @router.delete("/{cart_id}/items/{item_id}", response_model=schemas.CartItem)
 def remove_item(cart_id: int, item_id: int, db: Session = Depends(get_db)):
     """Remove an item from the cart by item id."""
-    c = crud.get_cart(db, cart_id)
+    c = crud.get_cart(db, cart_id, load_items=False)
     if not c:
         raise HTTPException(status_code=404, detail="Cart not found")
     item = crud.remove_item_from_cart(db, c, item_id)
@@ -46,13 +69,27 @@ def remove_item(cart_id: int, item_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/{cart_id}/checkout", response_model=schemas.Order)
-def checkout(cart_id: int, db: Session = Depends(get_db)):
-    """Convert the cart into an order. Returns the created `Order`."""
-    c = crud.get_cart(db, cart_id)
+def checkout(
+    cart_id: int,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: Session = Depends(get_db),
+    user: Optional[schemas.User] = Depends(get_optional_user),
+):
+    """Convert the cart into an order. Returns the created `Order`.
+
+    Send an `Idempotency-Key` header to make retries safe: repeating the
+    request with the same key returns the original order. With a bearer
+    token, an anonymous cart's order is recorded in that user's history.
+    Stock of tracked products is reserved for the order; if any line is
+    short, nothing changes and 409 is returned.
+    """
+    c = crud.get_cart(db, cart_id, load_items=False)
     if not c:
         raise HTTPException(status_code=404, detail="Cart not found")
     try:
-        order = crud.create_order_from_cart(db, c)
+        order = crud.create_order_from_cart(db, c, idempotency_key, user_id=user.id if user else None)
+    except crud.OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return order
+    return FastJSONResponse(crud.get_order_json(db, order.id))
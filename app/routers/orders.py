@@ -1,15 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from .. import crud, schemas
 from ..db import get_db
+from ..deps import get_current_user
+from ..responses import FastJSONResponse
 
 router = APIRouter()
 
 
+@router.get("/", response_model=schemas.OrderPage)
+def list_orders(
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = Query(None, description="Cursor from a previous page's `next_cursor`"),
+    user: schemas.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """The signed-in user's orders, newest first, with their line items."""
+    try:
+        return FastJSONResponse(crud.list_user_orders(db, user.id, limit=limit, after=after))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/{order_id}", response_model=schemas.Order)
 def get_order(order_id: int, db: Session = Depends(get_db)):
-    """Return order details including line items and paid status."""
-    o = crud.get_order(db, order_id)
-    if not o:
+    """Return order details including line items (as purchased) and paid status."""
+    body = crud.get_order_json(db, order_id)
+    if body is None:
         raise HTTPException(status_code=404, detail="Order not found")
-    return o
+    return FastJSONResponse(body)
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException,  Request 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .. import crud, schemas
-from ..db import get_db
+from .. import crud, payment_providers, schemas, webhooks
+from ..db import get_async_db, get_db
 import stripe
 from dotenv import load_dotenv
 import os
+from datetime import datetime, timedelta
 
 
 load_dotenv()  # Load environment variables from .env file
@@ -13,6 +15,13 @@ load_dotenv()  # Load environment variables from .env file
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY" )
 # You'll get this after setting up a webhook in Stripe Dashboard/CLI
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", ) 
+# Cached checkout sessions with less time left than this are replaced
+CHECKOUT_SESSION_MIN_REMAINING = timedelta(seconds=int(os.getenv("CHECKOUT_SESSION_MIN_REMAINING", "300")))
+# Stripe sessions must live at least 30 minutes; a reservation ending sooner
+# than this is extended to CHECKOUT_HOLD_SECONDS from now (within the order's
+# maximum hold) before opening one
+CHECKOUT_SESSION_MIN_LIFETIME = timedelta(minutes=31)
+CHECKOUT_HOLD_SECONDS = int(os.getenv("CHECKOUT_HOLD_SECONDS", str(60 * 60)))
 
 
 router = APIRouter()
@@ -31,44 +40,76 @@ def pay(payload: schemas.PaymentCreate, db: Session = Depends(get_db)):
     order = crud.get_order(db, payload.order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    if order.paid:
-        raise HTTPException(status_code=400, detail="Order already paid")
     payment = crud.create_payment(db, order, payload.amount, payload.provider)
+    if payment is None:
+        db.refresh(order)
+        if order.stock_released_at is not None and not order.paid:
+            raise HTTPException(status_code=409, detail="Order reservation expired")
+        raise HTTPException(status_code=400, detail="Order already paid")
     return payment
 
 
 
 
 @router.post("/create-checkout-session/", response_model=schemas.StripeSessionResponse)
-async def create_checkout_session(payload: schemas.OrderReference, db: Session = Depends(get_db)):
-    order = crud.get_order(db, payload.order_id)
+async def create_checkout_session(payload: schemas.OrderReference, db: AsyncSession = Depends(get_async_db)):
+    """Return a checkout URL for an unpaid order.
+
+    The order's open session is reused until shortly before it expires;
+    otherwise a new one is created through the configured payment provider.
+    """
+    order = await crud.get_order_async(db, payload.order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    
+    if order.paid:
+        raise HTTPException(status_code=400, detail="Order already paid")
+    if order.stock_released_at is not None:
+        raise HTTPException(status_code=409, detail="Order reservation expired")
+
+    now = datetime.utcnow()
+    reserved_until = order.reserved_until
+    expires_at = order.checkout_session_expires_at
+    if (
+        order.checkout_session_url and expires_at and expires_at > now + CHECKOUT_SESSION_MIN_REMAINING
+        and (reserved_until is None or expires_at <= reserved_until)
+    ):
+        return {"checkout_url": order.checkout_session_url}
+
+    # An order holding stock gets a session that ends with its reservation,
+    # so it can't be paid after the sweeper released the stock. The expiry
+    # is read from the DB (after a conditional extension), never from the
+    # clock, so concurrent requests send the same params under the same key.
+    # Extensions stop at crud.STOCK_RESERVATION_MAX_SECONDS after the order
+    # was placed, so re-requesting sessions can't hold the stock forever.
+    if reserved_until is not None and reserved_until < now + CHECKOUT_SESSION_MIN_LIFETIME:
+        reserved_until = await crud.extend_reservation_async(
+            db, order.id, reserved_until, now + timedelta(seconds=CHECKOUT_HOLD_SECONDS)
+        )
+        if reserved_until is None:
+            raise HTTPException(status_code=409, detail="Order reservation expired")
+        if reserved_until < now + CHECKOUT_SESSION_MIN_LIFETIME:
+            raise HTTPException(status_code=409, detail="Order reservation ends too soon for a new checkout session")
+
+    # Keyed on the session being replaced, so concurrent requests for the
+    # same order get the same provider session back
+    idempotency_key = f"checkout-order-{order.id}-{order.checkout_session_id or 'first'}"
     try:
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {'name': f"Order #{order.id}"},
-                    'unit_amount': int(order.total_amount * 100), # Stripe uses cents
-                },
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url="https://e-commerce-store-wine-one.vercel.app/success?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url="https://e-commerce-store-wine-one.vercel.app/cancel",
-
-            # VERY IMPORTANT: This links the Stripe payment to your DB order
-            metadata={"order_id": str(order.id)} 
+        session = await payment_providers.get_provider().create_checkout_session(
+            order.id, int(round(order.total_amount * 100)), idempotency_key,  # Stripe uses cents
+            expires_at=reserved_until,
         )
-        return {"checkout_url": session.url}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    await crud.set_checkout_session_async(db, order.id, session.id, session.url, session.expires_at)
+    return {"checkout_url": session.url}
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Receive a Stripe event.
+
+    The event is only stored in the webhook inbox (duplicates ignored) and
+    acknowledged; the background worker in `webhooks.py` applies it.
+    """
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
 
@@ -77,14 +118,6 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid Webhook Signature")
 
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        order_id = int(session['metadata']['order_id'])
-        amount = session['amount_total'] / 100
-        
-        # Mark order as paid using your existing CRUD logic
-        order = crud.get_order(db, order_id)
-        if order:
-            crud.create_payment(db, order, amount, provider="stripe")
-            
+    if await crud.record_webhook_event_async(db, event["id"], event["type"], payload.decode("utf-8")):
+        webhooks.notify()
     return {"status": "success"}
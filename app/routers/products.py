@@ -1,75 +1,206 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import List, Optional
+import io
 import os
-import uuid
-from fastapi import UploadFile, File, Form
+from fastapi import UploadFile, File
 from fastapi.staticfiles import StaticFiles
 
 
-from .. import crud, schemas
-from ..db import get_db
+from .. import crud, images, importer, schemas
+from ..db import AsyncSessionLocal, get_async_db, get_db, get_read_db, read_engine
+from ..responses import json_response
+from ..uploads import UploadRejected, receive_upload
 
 router = APIRouter()
 
-
+# Most ids accepted by one `GET /products/batch`
+PRODUCT_BATCH_MAX = int(os.getenv("PRODUCT_BATCH_MAX", "100"))
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # app/routers/
 APP_DIR = os.path.dirname(BASE_DIR)                    # app/
 STATIC_DIR = os.path.join(APP_DIR, "static")
 UPLOAD_DIR = os.path.join(STATIC_DIR, "uploads")
+# Partial uploads: outside the served static tree, same filesystem for the rename
+UPLOAD_TMP_DIR = os.path.join(APP_DIR, "upload_tmp")
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-
-@router.post("/upload", response_model=schemas.Product)
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+
+async def _record_image_variants(filename: str):
+    # Background task: build the derivatives of an upload, then store their URLs
+    variants = await images.generate_variants(os.path.join(UPLOAD_DIR, filename))
+    if not variants:
+        return
+    async with AsyncSessionLocal() as db:
+        await crud.set_image_variants_async(
+            db,
+            f"/static/uploads/{filename}",
+            {name: f"/static/uploads/{variant}" for name, variant in variants.items()},
+        )
+
+
+# The upload form is parsed by `receive_upload`, not by FastAPI, so it is
+# described to OpenAPI here
+UPLOAD_FORM = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["name", "price", "image"],
+    "properties": {
+        "name": {"type": "string"},
+        "price": {"type": "number"},
+        "image": {"type": "string", "format": "binary"},
+    },
+}}}}}
+
+
+@router.post("/upload", response_model=schemas.Product, openapi_extra=UPLOAD_FORM)
 async def create_product_with_image(
-    name: str = Form(...),
-    price: float = Form(...),
-    image: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # 1. Handle File Saving
-    ext = image.filename.split(".")[-1]
-    filename = f"{uuid.uuid4()}.{ext}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    # 1. Parse the form as it arrives: oversized bodies are refused before
+    #    being read, the image streams to a temp file (size-limited, type
+    #    sniffed). Identical files map to the same content-addressed name.
+    try:
+        fields, image = await receive_upload(request, UPLOAD_DIR, UPLOAD_TMP_DIR)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-    with open(file_path, "wb") as f:
-        f.write(await image.read())
-
-    image_url = f"/static/uploads/{filename}"
+    image_url = f"/static/uploads/{image.filename}"
 
     # 2. Prepare the Schema
-    product_data = schemas.ProductCreate(
-        name=name, 
-        price=price, 
-        image_url=image_url
-    )
+    try:
+        product_data = schemas.ProductCreate(
+            name=fields.get("name"),
+            price=fields.get("price"),
+            image_url=image_url
+        )
+    except ValidationError as e:
+        await image.discard()
+        raise RequestValidationError(e.errors(include_url=False))
+    filename = await image.commit()
+
+    # 3. Use CRUD to Save and Return; thumbnails/WebP are made after the response
+    product = await crud.create_product_async(db, product_data)
+    background_tasks.add_task(_record_image_variants, filename)
+    return product
+
+@router.post("/import", response_model=schemas.ImportReport)
+def import_products(
+    file: UploadFile = File(..., description="CSV with a header row, or JSON Lines"),
+    format: Optional[str] = Query(None, pattern="^(csv|jsonl)$"),
+    batch_size: int = Query(importer.IMPORT_BATCH_SIZE, ge=1, le=50000),
+    db: Session = Depends(get_db),
+):
+    """Bulk create/update products (upserted by `sku`) from a streamed file.
+
+    Rows are validated like `ProductCreate`; invalid rows are skipped and
+    listed in the report by line number.
+    """
+    fmt = format or importer.detect_format(file.filename, file.content_type)
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return importer.import_products(db, stream, fmt, batch_size)
+    finally:
+        stream.detach()
 
-    # 3. Use CRUD to Save and Return
-    return crud.create_product(db, product_data)
 
 @router.get("/", response_model=schemas.PaginatedProducts)
-def list_products(q: Optional[str] = Query(None), page: int = 1, per_page: int = 20, db: Session = Depends(get_db)):
+def list_products(
+    q: Optional[str] = Query(None),
+    page: int = 1,
+    per_page: int = 20,
+    after: Optional[str] = Query(None, description="Cursor from a previous page's `next_cursor`"),
+    with_total: bool = Query(True, description="Set to false to skip computing `total`"),
+    sort: Optional[str] = Query(None, pattern="^(price|name|newest)$", description="Defaults to relevance when searching, else id"),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    db: Session = Depends(get_read_db),
+):
+    """List products, paginated either by `page` (offset) or by `after` (cursor).
+
+    Cursor paging costs the same for every page; prefer it for deep browsing.
+    A cursor is only valid with the `sort` and filters it was issued for.
+    """
     if page < 1: page = 1
     if per_page < 1: per_page = 20
     skip = (page - 1) * per_page
 
-    # Updated: Filter by name only since description is removed
-    query = db.query(crud.models.Product)
-    if q:
-        query = query.filter(crud.models.Product.name.ilike(f"%{q}%"))
-    
-    total = query.count()
-    items = query.offset(skip).limit(per_page).all()
+    try:
+        items, total, next_cursor = crud.list_products(
+            db, skip=skip, limit=per_page, q=q, after=after, with_total=with_total,
+            sort=sort, min_price=min_price, max_price=max_price,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    page_out = schemas.PaginatedProducts(
+        items=items, total=total, page=page, per_page=per_page, next_cursor=next_cursor
+    )
+    return json_response(page_out, schemas.PaginatedProducts)
+
+@router.get("/suggest", response_model=List[schemas.Product])
+def suggest_products(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=25), db: Session = Depends(get_read_db)):
+    """Autocomplete: products whose name has words starting with the typed text."""
+    return json_response([row._asdict() for row in crud.suggest_products(db, q, limit)])
+
+
+@router.get("/batch", response_model=schemas.ProductBatch)
+def get_products_batch(
+    ids: str = Query(..., pattern=r"^\d{1,18}(,\d{1,18})*$", description="Comma-separated product ids"),
+    db: Session = Depends(get_read_db),
+    primary: Session = Depends(get_db),
+):
+    """Fetch many products by id in one round trip (carts, wishlists, ...).
+
+    Items come back in the requested order, once per id; ids that don't
+    exist are listed in `missing`.
+    """
+    product_ids = list(dict.fromkeys(int(i) for i in ids.split(",")))
+    if len(product_ids) > PRODUCT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PRODUCT_BATCH_MAX} ids per request")
+    found = crud.get_products_cached(db, product_ids)
+    if read_engine is not None and len(found) < len(product_ids):
+        # Products created since the replica last caught up
+        found.update(crud.get_products_cached(primary, [i for i in product_ids if i not in found]))
+    batch = schemas.ProductBatch(
+        items=[found[i] for i in product_ids if i in found],
+        missing=[i for i in product_ids if i not in found],
+    )
+    return json_response(batch, schemas.ProductBatch)
+
+
+@router.get("/{product_id}/stock", response_model=schemas.StockLevel)
+def get_stock(product_id: int, db: Session = Depends(get_db)):
+    """Current available stock (`stock` is null when not tracked)."""
+    level = crud.get_stock(db, product_id)
+    if level is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return level
+
+
+@router.put("/{product_id}/stock", response_model=schemas.StockLevel)
+def set_stock(product_id: int, payload: schemas.StockUpdate, db: Session = Depends(get_db)):
+    """Set available stock; null stops tracking it. With `shards`, the stock
+    is split over that many counters to spread contention on hot items."""
+    if crud.get_stock(db, product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return crud.set_stock(db, product_id, payload.stock, payload.shards)
 
-    return schemas.PaginatedProducts(items=items, total=total, page=page, per_page=per_page)
 
 @router.get("/{product_id}", response_model=schemas.Product)
-def get_product(product_id: int, db: Session = Depends(get_db)):
+def get_product(product_id: int, db: Session = Depends(get_read_db), primary: Session = Depends(get_db)):
     """Fetch a single product by id."""
-    p = crud.get_product(db, product_id)
+    p = crud.get_product_cached(db, product_id)
+    if not p and read_engine is not None:
+        # Read-your-writes: a product just created may not be on the replica yet
+        p = crud.get_product_cached(primary, product_id)
     if not p:
         raise HTTPException(status_code=404, detail="Product not found")
-    return p
+    return json_response(p, schemas.Product)
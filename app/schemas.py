@@ -1,30 +1,67 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel, Field
 
 
 class ProductBase(BaseModel):
     name: str
     price: float
     image_url: Optional[str] = None
+    sku: Optional[str] = None
 
 
 class ProductCreate(ProductBase):
-    pass
+    # Units available; leave unset to not track stock
+    stock: Optional[int] = Field(None, ge=0)
+
+
+class StockUpdate(BaseModel):
+    stock: Optional[int] = Field(..., ge=0)
+    # Split the stock over this many counters (hot items); unset for one
+    shards: Optional[int] = Field(None, ge=2, le=64)
+
+
+class StockLevel(BaseModel):
+    product_id: int
+    stock: Optional[int] = None
+    shards: Optional[int] = None
 
 
 class Product(ProductBase):
     id: int
+    image_variants: Optional[Dict[str, str]] = None
     model_config = {"from_attributes": True}
 
 
 class PaginatedProducts(BaseModel):
     items: List[Product]
-    total: int
+    total: Optional[int] = None
     page: int
     per_page: int
+    next_cursor: Optional[str] = None
+    model_config = {"from_attributes": True}
+
+
+class ProductBatch(BaseModel):
+    # Found products in request order, and requested ids that don't exist
+    items: List[Product]
+    missing: List[int] = []
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
 
-    class Config:
-        orm_mode = True
+
+class ImportReport(BaseModel):
+    rows: int
+    imported: int
+    failed: int
+    # Rows replaced by a later row with the same sku in the same batch
+    superseded: int = 0
+    batches: int
+    seconds: float
+    errors: List[ImportRowError] = []
 
 
 class CartItemCreate(BaseModel):
@@ -32,6 +69,21 @@ class CartItemCreate(BaseModel):
     quantity: int = 1
 
 
+class CartLineUpdate(BaseModel):
+    """One line of a batch cart update.
+
+    `increment` adds `quantity` (negative to decrease), `set` replaces it and
+    `remove` deletes the line. Lines reaching zero or less are removed.
+    """
+    product_id: int
+    quantity: int = 1
+    op: Literal["increment", "set", "remove"] = "increment"
+
+
+class CartBatchUpdate(BaseModel):
+    items: List[CartLineUpdate] = Field(..., max_length=200)
+
+
 class CartItem(BaseModel):
     id: int
     product: Product
@@ -61,9 +113,15 @@ class Order(BaseModel):
     id: int
     total_amount: float
     paid: bool
+    created_at: Optional[datetime] = None
     items: List[OrderItem] = []
     model_config = {"from_attributes": True}
 
+
+class OrderPage(BaseModel):
+    items: List[Order]
+    next_cursor: Optional[str] = None
+
 # Add this to app/schemas.py
 class OrderReference(BaseModel):
     order_id: int
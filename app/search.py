@@ -0,0 +1,100 @@
+import re
+
+from sqlalchemy import column, func, table, text
+from sqlalchemy.exc import DBAPIError
+
+from . import models
+
+# Full-text product search.
+#
+# SQLite: an external-content FTS5 table `products_fts` mirrors
+# `products.name` and is kept in sync by triggers, so every write path
+# (`crud.create_product`, uploads, raw SQL) updates the index. A prefix index
+# makes "wid" match "Widget" for autocomplete. Ranking uses FTS5's bm25 `rank`.
+#
+# PostgreSQL: a GIN expression index over `to_tsvector('simple', name)` with
+# prefix `tsquery` terms and `ts_rank` ordering.
+#
+# Other backends (or SQLite builds without FTS5) fall back to ILIKE.
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TOKENS = 8
+
+_fts = table("products_fts", column("rowid"), column("rank"))
+
+# Set by `init_search` once the backend's index is known to exist.
+_backend = None
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "name, content='products', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name); END",
+]
+
+_POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_products_name_fts ON products "
+    "USING gin (to_tsvector('simple', coalesce(name, '')))",
+]
+
+
+def init_search(engine):
+    """Create the search index for the engine's backend (idempotent).
+
+    Called from `db.init_db` after the tables exist. On SQLite the FTS table
+    is backfilled from `products` the first time it is created.
+    """
+    global _backend
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == "sqlite":
+                existed = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")
+                ).first()
+                for stmt in _SQLITE_DDL:
+                    conn.execute(text(stmt))
+                if not existed:
+                    conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            elif dialect == "postgresql":
+                for stmt in _POSTGRES_DDL:
+                    conn.execute(text(stmt))
+            else:
+                return
+    except DBAPIError:
+        # e.g. SQLite compiled without FTS5: keep the ILIKE fallback
+        _backend = None
+        return
+    _backend = dialect
+
+
+def tokenize(q: str):
+    """Split a user query into at most `MAX_TOKENS` word tokens."""
+    return _TOKEN_RE.findall(q or "")[:MAX_TOKENS]
+
+
+def apply_search(query, q: str):
+    """Filter an ORM query over `Product` by `q`.
+
+    Returns `(query, rank)` where `rank` is a SQL expression ordering best
+    matches first when sorted ascending, or None if the fallback ILIKE
+    filter was used (no relevance available). Every token is matched as a
+    prefix, so partial input works for autocomplete.
+    """
+    tokens = tokenize(q)
+    if not tokens or _backend is None:
+        return query.filter(models.Product.name.ilike(f"%{q}%")), None
+    if _backend == "sqlite":
+        match = " ".join(f'"{t}"*' for t in tokens)
+        query = query.join(_fts, _fts.c.rowid == models.Product.id).filter(
+            text("products_fts MATCH :fts_query").bindparams(fts_query=match)
+        )
+        return query, _fts.c.rank
+    vector = func.to_tsvector("simple", func.coalesce(models.Product.name, ""))
+    tsquery = func.to_tsquery("simple", " & ".join(f"{t}:*" for t in tokens))
+    return query.filter(vector.op("@@")(tsquery)), -func.ts_rank(vector, tsquery)
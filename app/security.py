@@ -1,6 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
+import os
 import secrets
+import threading
+import time
 
 from passlib.context import CryptContext
 from jose import jwt, JWTError
@@ -19,7 +24,11 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 # byte limit error while preserving bcrypt's strengths. This also avoids
 # edge-cases where the installed `bcrypt` package may not expose metadata
 # attributes passlib expects.
-pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+#
+# BCRYPT_ROUNDS sets the cost factor. Hashes made with a different cost are
+# reported by `verify_and_update_async` so login can transparently rehash them.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto", bcrypt_sha256__rounds=BCRYPT_ROUNDS)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -32,6 +41,108 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# Password hashing executor.
+#
+# Each bcrypt call burns hundreds of milliseconds of CPU. Async routes hand
+# the work to this dedicated pool instead of running it on the event loop or
+# FastAPI's shared threadpool, so a login burst uses at most HASH_WORKERS cores
+# and never holds the threads catalog requests need. bcrypt releases the GIL,
+# so threads are enough. When more than HASH_MAX_QUEUE calls are already
+# waiting, new ones fail fast with `HashingBusy` rather than queueing forever.
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "64"))
+
+
+class HashingBusy(Exception):
+    """Raised when the password hashing queue is full."""
+
+
+class _HashExecutor:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashingBusy("Password hashing queue is full")
+            self.in_flight += 1
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self.queue_seconds += started - submitted
+                    self.hash_seconds += finished - started
+
+        # The slot is released when the pool is done with the job, not when
+        # the caller stops waiting: a request cancelled mid-hash (client
+        # disconnect) leaves its bcrypt call running, and it still counts
+        # against HASH_MAX_QUEUE until it finishes
+        future = self._pool.submit(job)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            if future.cancelled():
+                return
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_seconds": self.queue_seconds,
+                "hash_seconds": self.hash_seconds,
+            }
+
+
+_hasher = _HashExecutor(HASH_WORKERS, HASH_MAX_QUEUE)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """`get_password_hash` on the hashing executor."""
+    return await _hasher.run(pwd_context.hash, password)
+
+
+async def verify_and_update_async(plain_password: str, hashed_password: str):
+    """Verify on the hashing executor.
+
+    Returns `(valid, new_hash)`; `new_hash` is not None when the stored hash
+    uses outdated settings (e.g. a different BCRYPT_ROUNDS) and should be
+    replaced.
+    """
+    return await _hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def hashing_stats() -> dict:
+    return _hasher.stats()
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token embedding provided `data` and `exp` claim."""
     to_encode = data.copy()
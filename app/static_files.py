@@ -0,0 +1,139 @@
+import gzip
+import mimetypes
+import os
+import re
+import shutil
+import sys
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip siblings are produced without it
+    brotli = None
+
+# Static file serving tuned for browser and CDN caches.
+#
+# - Uploads are named by uuid or content hash (see `uploads.receive_upload`), so
+#   their bytes never change: they get a one-year `immutable` Cache-Control
+#   and a strong ETag derived from the name. Other files get a short max-age
+#   and an ETag from size and mtime.
+# - If the client accepts it, a precompressed `<file>.br` / `<file>.gz`
+#   sibling is served with Content-Encoding instead of the original.
+# - Conditional requests (If-None-Match / If-Modified-Since) get a 304 without
+#   opening the file, and Range requests are handled by `FileResponse`.
+# - `*.part` files are files still being written (image variants, compressed
+#   siblings) before their atomic rename, and are never served.
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+
+_FINGERPRINTED = re.compile(
+    r"^(?P<key>[0-9a-f]{64}(?:_\w+)?|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.\w+$"
+)
+# Sibling suffix -> Content-Encoding, in order of preference
+_ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+# Suffix of files being written, renamed into place once complete
+PARTIAL_SUFFIX = ".part"
+# Types worth precompressing; raster images are already compressed
+_COMPRESSIBLE = {".svg", ".css", ".js", ".json", ".txt", ".html", ".xml"}
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+class CachedStaticFiles(StaticFiles):
+    """`StaticFiles` with long-lived caching, strong ETags and precompressed variants."""
+
+    async def get_response(self, path: str, scope):
+        if path.endswith(PARTIAL_SUFFIX):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(full_path)
+        fingerprint = _FINGERPRINTED.match(name)
+        media_type = mimetypes.guess_type(name)[0] or "text/plain"
+
+        path, encoding = full_path, None
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        for suffix, candidate in _ENCODINGS:
+            if candidate in accepted:
+                try:
+                    stat_result = os.stat(str(full_path) + suffix)
+                except OSError:
+                    continue
+                path, encoding = str(full_path) + suffix, candidate
+                break
+
+        if fingerprint:
+            tag = fingerprint.group("key")
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            tag = f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+            cache_control = f"public, max-age={STATIC_MAX_AGE}"
+        headers = {
+            "cache-control": cache_control,
+            "etag": f'"{tag}-{encoding}"' if encoding else f'"{tag}"',
+            "vary": "Accept-Encoding",
+        }
+        if encoding:
+            headers["content-encoding"] = encoding
+
+        response = FileResponse(
+            path, status_code=status_code, headers=headers, media_type=media_type, stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress(directory: str) -> int:
+    """Write `.gz` (and `.br` when brotli is installed) siblings for text-like
+    files under `directory` that lack an up-to-date one. Returns the count written."""
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in _COMPRESSIBLE:
+                continue
+            src = os.path.join(root, name)
+            mtime = os.stat(src).st_mtime
+            targets = [(".gz", lambda data: gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                targets.append((".br", lambda data: brotli.compress(data, quality=11)))
+            data = None
+            for suffix, compress in targets:
+                dest = src + suffix
+                if os.path.exists(dest) and os.stat(dest).st_mtime >= mtime:
+                    continue
+                if data is None:
+                    with open(src, "rb") as f:
+                        data = f.read()
+                with open(dest + PARTIAL_SUFFIX, "wb") as f:
+                    f.write(compress(data))
+                shutil.copystat(src, dest + PARTIAL_SUFFIX)
+                os.replace(dest + PARTIAL_SUFFIX, dest)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    # python -m app.static_files [directory]
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "static")
+    print(f"precompressed {precompress(target)} file(s)")
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import tempfile
+
+from fastapi import Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# Streaming image uploads. `receive_upload` parses the multipart body itself
+# as it arrives from the client, instead of letting the framework spool the
+# whole form to a temporary file before the route runs: a body whose
+# Content-Length is over the limit is refused before any of it is read, and
+# one that turns out larger (chunked, or lying) is cut off as soon as the
+# count passes the limit. Image data goes to disk chunk by chunk (as the
+# server receives it) with the blocking file I/O pushed to the threadpool,
+# so the event loop never waits on the disk. Files are written to a temp
+# name in `tmp_directory` (which must not be served, and must be on the same
+# filesystem as the target directory) and renamed into place atomically once
+# the route accepts them, so readers never see a partial image.
+#
+# Storage is content-addressed: the file name is the SHA-256 of the bytes, so
+# uploading the same image again reuses the stored copy.
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Room in a form body beyond the image: text fields, part headers, boundaries
+MAX_FORM_OVERHEAD = int(os.getenv("MAX_FORM_OVERHEAD", str(64 * 1024)))
+# Bytes needed to recognize every accepted format
+SNIFF_BYTES = 12
+
+# Magic numbers of accepted image formats -> stored file extension. The
+# client's filename and Content-Type are not trusted.
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload is refused; `status_code` is the HTTP status to return."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+def sniff_image_type(head: bytes):
+    """Return the file extension for the image format in `head`, or None."""
+    for magic, ext in _SIGNATURES:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _finish(f, tmp_path: str, final_path: str):
+    if os.path.exists(final_path):
+        # Same content already stored
+        _discard(f, tmp_path)
+        return
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(tmp_path, final_path)
+
+
+def _discard(f, tmp_path: str):
+    f.close()
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+class PendingImage:
+    """An image part being received into a temp file in `tmp_directory`.
+
+    `commit()` moves it into `directory` under its content address and
+    returns the file name; `discard()` drops it.
+    """
+
+    def __init__(self, directory: str, tmp_directory: str, max_bytes: int):
+        self.directory = directory
+        self.tmp_directory = tmp_directory
+        self.max_bytes = max_bytes
+        self.ext = None
+        self.size = 0
+        self._head = b""
+        self._digest = hashlib.sha256()
+        self._file = None
+        self._tmp_path = None
+
+    @property
+    def filename(self) -> str:
+        return f"{self._digest.hexdigest()}.{self.ext}"
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(413, f"Image larger than {self.max_bytes} bytes")
+        if self._file is None:
+            # Hold the first bytes back until the type can be sniffed
+            self._head += data
+            if len(self._head) < SNIFF_BYTES:
+                return
+            data, self._head = self._head, b""
+            await self._open(data)
+        self._digest.update(data)
+        await run_in_threadpool(self._file.write, data)
+
+    async def _open(self, head: bytes):
+        self.ext = sniff_image_type(head)
+        if self.ext is None:
+            raise UploadRejected(415, "Unsupported image type")
+        fd, self._tmp_path = await run_in_threadpool(tempfile.mkstemp, dir=self.tmp_directory, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    async def end(self):
+        # End of the part: flush a held-back head (images under SNIFF_BYTES)
+        if self._file is None:
+            head, self._head = self._head, b""
+            await self._open(head)
+            self._digest.update(head)
+            await run_in_threadpool(self._file.write, head)
+
+    async def commit(self) -> str:
+        filename = self.filename
+        await run_in_threadpool(_finish, self._file, self._tmp_path, os.path.join(self.directory, filename))
+        return filename
+
+    async def discard(self):
+        if self._file is not None:
+            await run_in_threadpool(_discard, self._file, self._tmp_path)
+
+
+class _FormReader:
+    # python-multipart callbacks: text fields are collected in memory (within
+    # MAX_FORM_OVERHEAD), image data is queued for `PendingImage.write`,
+    # which has to be awaited outside the synchronous callbacks
+    def __init__(self, directory: str, tmp_directory: str, file_field: str, max_bytes: int):
+        self.directory = directory
+        self.tmp_directory = tmp_directory
+        self.file_field = file_field
+        self.max_bytes = max_bytes
+        self.fields = {}
+        self.image = None
+        self.image_done = False
+        self.image_chunks = []
+        self._field_bytes = 0
+        self._name = None
+        self._data = None
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            if self._name != self.file_field or self.image is not None:
+                raise UploadRejected(400, f"Unexpected file field {self._name!r}")
+            self.image = PendingImage(self.directory, self.tmp_directory, self.max_bytes)
+            self._data = None
+        else:
+            self._data = bytearray()
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._data is None:
+            self.image_chunks.append(data[start:end])
+            return
+        self._field_bytes += end - start
+        if self._field_bytes > MAX_FORM_OVERHEAD:
+            raise UploadRejected(413, "Form fields too large")
+        self._data += data[start:end]
+
+    def on_part_end(self):
+        if self._data is None:
+            self.image_done = True
+        else:
+            self.fields[self._name] = self._data.decode("utf-8", "replace")
+
+
+async def receive_upload(request: Request, directory: str, tmp_directory: str, file_field: str = "image",
+                         max_bytes: int = MAX_UPLOAD_BYTES):
+    """Parse a `multipart/form-data` request with one image file as it
+    streams in. Returns `(fields, image)`: the text fields as a dict, and the
+    `file_field` part as a `PendingImage` for the caller to commit into
+    `directory` or discard.
+
+    Raises `UploadRejected`: 413 when the body or the image is over the
+    limit (checked against Content-Length before reading), 415 when the
+    image is not a PNG, JPEG, GIF or WebP, 400/422 for a malformed form or
+    a missing image.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data body")
+    limit = max_bytes + MAX_FORM_OVERHEAD
+    try:
+        declared = int(request.headers.get("content-length", 0))
+    except ValueError:
+        raise UploadRejected(400, "Invalid Content-Length") from None
+    if declared > limit:
+        raise UploadRejected(413, f"Image larger than {max_bytes} bytes")
+
+    reader = _FormReader(directory, tmp_directory, file_field, max_bytes)
+    parser = MultipartParser(params[b"boundary"], reader.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise UploadRejected(413, f"Image larger than {max_bytes} bytes")
+            try:
+                parser.write(chunk)
+            except MultipartParseError:
+                raise UploadRejected(400, "Malformed multipart body") from None
+            for data in reader.image_chunks:
+                await reader.image.write(data)
+            reader.image_chunks.clear()
+            if reader.image_done:
+                reader.image_done = False
+                await reader.image.end()
+        try:
+            parser.finalize()
+        except MultipartParseError:
+            raise UploadRejected(400, "Malformed multipart body") from None
+        if reader.image is None:
+            raise UploadRejected(422, f"Missing file field {file_field!r}")
+    except BaseException:
+        if reader.image is not None:
+            await reader.image.discard()
+        raise
+    return reader.fields, reader.image
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, models
+from .db import SessionLocal
+
+# Webhook inbox processing.
+#
+# `POST /payments/webhook` only verifies the signature and inserts the event
+# into `webhook_events` (ON CONFLICT DO NOTHING on the provider's event id),
+# so the provider gets its 2xx in one small write however busy the DB is,
+# and redeliveries of an event are dropped at the door.
+#
+# A background task in each app process then applies due events. An event is
+# first claimed by a conditional UPDATE that pushes `next_attempt_at` out by
+# a lease, so concurrent workers never apply it at the same time; its handler
+# and the `processed` mark commit in one transaction, so a crash mid-way
+# leaves it pending for a retry. Failures back off exponentially and the
+# event is marked failed after WEBHOOK_MAX_ATTEMPTS. Handlers must still be
+# idempotent (`crud.record_payment` is) since a lease can expire mid-apply.
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_WORKER = os.getenv("WEBHOOK_WORKER", "1") != "0"
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "5"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "10"))
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", "5"))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "3600"))
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "60"))
+
+# Event type -> handler(db, event_object); unknown types are marked processed
+HANDLERS = {}
+
+
+def handles(event_type: str):
+    def register(fn):
+        HANDLERS[event_type] = fn
+        return fn
+    return register
+
+
+@handles("checkout.session.completed")
+def _checkout_session_completed(db, session: dict):
+    order_id = int(session["metadata"]["order_id"])
+    if crud.get_order(db, order_id) is None:
+        return
+    amount = session["amount_total"] / 100
+    payment = crud.record_payment(db, order_id, amount, provider="stripe", reference=session.get("id"))
+    if payment is not None and payment.status == "refund_required":
+        # Charged for an order that was released and sold out, or paid twice
+        logger.warning("payment %s for order %s needs a refund", session.get("id"), order_id)
+
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before retrying an event that has failed `attempts` times."""
+    seconds = WEBHOOK_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, WEBHOOK_BACKOFF_MAX_SECONDS))
+
+
+def _claim(db, event_id: str, now: datetime) -> bool:
+    Event = models.WebhookEvent
+    claimed = db.query(Event).filter(
+        Event.id == event_id, Event.status == "pending", Event.next_attempt_at <= now
+    ).update(
+        {"attempts": Event.attempts + 1, "next_attempt_at": now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)},
+        synchronize_session=False,
+    )
+    db.commit()
+    return claimed == 1
+
+
+def apply_event(db, event_id: str) -> bool:
+    """Claim and apply one inbox event. Returns True if it was processed."""
+    now = datetime.utcnow()
+    if not _claim(db, event_id, now):
+        return False
+    event = db.get(models.WebhookEvent, event_id)
+    try:
+        handler = HANDLERS.get(event.type)
+        if handler is not None:
+            handler(db, json.loads(event.payload)["data"]["object"])
+        event.status = "processed"
+        event.processed_at = datetime.utcnow()
+        event.last_error = None
+        db.commit()
+        return True
+    except Exception as exc:
+        db.rollback()
+        event = db.get(models.WebhookEvent, event_id)
+        if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+            event.status = "failed"
+        event.next_attempt_at = now + backoff(event.attempts)
+        event.last_error = f"{type(exc).__name__}: {exc}"[:1000]
+        db.commit()
+        logger.warning("webhook event %s failed (attempt %s): %s", event_id, event.attempts, exc)
+        return False
+
+
+def process_due(limit: int = WEBHOOK_BATCH_SIZE) -> int:
+    """Apply up to `limit` due inbox events. Returns how many were due."""
+    Event = models.WebhookEvent
+    with SessionLocal() as db:
+        due = [
+            row.id
+            for row in db.query(Event.id)
+            .filter(Event.status == "pending", Event.next_attempt_at <= datetime.utcnow())
+            .order_by(Event.next_attempt_at)
+            .limit(limit)
+        ]
+        db.rollback()
+        for event_id in due:
+            apply_event(db, event_id)
+    return len(due)
+
+
+_task = None
+_wake = None
+
+
+def notify():
+    """Wake the worker so a freshly received event is applied without
+    waiting for the next poll."""
+    if _wake is not None:
+        _wake.set()
+
+
+async def _run():
+    while True:
+        _wake.clear()
+        try:
+            while await run_in_threadpool(process_due) >= WEBHOOK_BATCH_SIZE:
+                pass
+        except Exception:
+            logger.exception("webhook worker pass failed")
+        try:
+            await asyncio.wait_for(_wake.wait(), WEBHOOK_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start():
+    global _task, _wake
+    if WEBHOOK_WORKER and _task is None:
+        _wake = asyncio.Event()
+        _task = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop():
+    global _task, _wake
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = _wake = None
+
+
+def sign_payload(payload: bytes, secret: str, timestamp: int = None) -> str:
+    """Return a `Stripe-Signature` header value for `payload`, so locally
+    built events pass `stripe.Webhook.construct_event`."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def fake_event(event_type: str, obj: dict, event_id: str = None) -> bytes:
+    """Serialize a minimal Stripe event envelope around `obj`."""
+    return json.dumps({
+        "id": event_id or f"evt_local_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {"object": obj},
+    }).encode()
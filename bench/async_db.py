@@ -0,0 +1,102 @@
+"""Concurrent throughput of one event loop: blocking vs async DB access.
+
+Runs the same `crud.get_order` lookup from many concurrent coroutines, first
+with a sync `Session` called directly on the loop (what `async def` routes did
+before `get_async_db`), then through `AsyncSession` via `crud.get_order_async`.
+Alongside, a heartbeat task measures event-loop lag, i.e. how long any other
+request on the worker would have been stalled.
+
+    python -m bench.async_db --orders 2000 --concurrency 50 --lookups 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.db import Base
+
+
+def seed(url: str, orders: int):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(models.Order(total_amount=random.uniform(1, 500)) for _ in range(orders))
+        db.commit()
+    engine.dispose()
+
+
+async def heartbeat(stop: asyncio.Event, lags: list, interval: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(mode: str, path: str, orders: int, concurrency: int, lookups: int) -> dict:
+    if mode == "sync":
+        # The pool must fit every coroutine: a blocking checkout on the loop
+        # thread can never be satisfied and deadlocks the whole worker.
+        engine = create_engine(
+            f"sqlite:///{path}", connect_args={"check_same_thread": False}, pool_size=concurrency
+        )
+        factory = sessionmaker(bind=engine)
+
+        async def worker():
+            with factory() as db:
+                for _ in range(lookups):
+                    crud.get_order(db, random.randint(1, orders))
+                    await asyncio.sleep(0)
+    else:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=concurrency)
+        factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+        async def worker():
+            async with factory() as db:
+                for _ in range(lookups):
+                    await crud.get_order_async(db, random.randint(1, orders))
+
+    stop, lags = asyncio.Event(), []
+    beat = asyncio.create_task(heartbeat(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    if mode == "sync":
+        engine.dispose()
+    else:
+        await engine.dispose()
+    lags.sort()
+    return {
+        "mode": mode,
+        "ops_per_s": round(concurrency * lookups / elapsed, 1),
+        "loop_lag_p50_ms": round(statistics.median(lags) * 1000, 2) if lags else None,
+        "loop_lag_max_ms": round(lags[-1] * 1000, 2) if lags else None,
+        "heartbeats": len(lags),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--lookups", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(f"sqlite:///{path}", args.orders)
+        for mode in ("sync", "async"):
+            print(asyncio.run(run(mode, path, args.orders, args.concurrency, args.lookups)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Sorted/filtered product listing: first vs deep cursor page cost.
+
+For every `sort` x price-filter combination this walks the listing with
+cursors and compares the first page's latency with the deepest one's; with
+index-backed sorts they stay the same. (The query plans themselves are
+checked by tests/test_product_listing.py.)
+
+    python -m bench.listing --products 100000 --per-page 20 --pages 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.db import Base, make_engine
+
+SORTS = (None, "price", "name", "newest")
+FILTERS = {"all": (None, None), "price_range": (50.0, 150.0), "min_price": (400.0, None)}
+
+
+def seed(engine, products: int):
+    Base.metadata.create_all(engine)
+    start = datetime(2024, 1, 1)
+    with sessionmaker(bind=engine)() as db:
+        db.execute(models.Product.__table__.insert(), [
+            {
+                "name": f"Product {random.randrange(products):08d}",
+                "price": round(random.uniform(1, 500), 2),
+                "created_at": start + timedelta(minutes=random.randrange(products)),
+            }
+            for _ in range(products)
+        ])
+        db.commit()
+
+
+def walk(factory, sort, min_price, max_price, per_page: int, pages: int):
+    """Milliseconds for the first and the last of `pages` cursor pages."""
+    timings = []
+    after = None
+    with factory() as db:
+        for _ in range(pages):
+            start = time.perf_counter()
+            _, _, after = crud._list_products(db, 0, per_page, None, after, False, sort, min_price, max_price)
+            timings.append((time.perf_counter() - start) * 1000)
+            if after is None:
+                break
+    return timings[0], timings[-1], len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--per-page", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        seed(engine, args.products)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        factory = sessionmaker(bind=engine)
+        for sort in SORTS:
+            for name, (min_price, max_price) in FILTERS.items():
+                first_ms, last_ms, walked = walk(factory, sort, min_price, max_price, args.per_page, args.pages)
+                print({
+                    "sort": sort or "id",
+                    "filter": name,
+                    "first_page_ms": round(first_ms, 2),
+                    f"page_{walked}_ms": round(last_ms, 2),
+                })
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Mixed-traffic load test of the API with per-route latency percentiles.
+
+Seeds a database at the requested scale, then runs `--concurrency` virtual
+users for `--duration` seconds. Each repeatedly picks a weighted scenario
+(browse, search, product page, add to cart, checkout, pay, login) and issues
+its requests. Traffic goes either in-process to `app.main:app` through
+httpx's ASGI transport (default, on a temporary SQLite database unless
+`--database-url` is given) or to a running server with `--url`.
+
+Results (throughput plus p50/p95/p99 per route) are written as stable,
+sorted JSON so runs from two commits can be diffed, or compared directly:
+
+    python -m bench.load --products 20000 --users 200 --concurrency 32 --duration 30 --out before.json
+    python -m bench.load ... --out after.json --compare before.json
+    python -m bench.load --url http://127.0.0.1:8000 --database-url sqlite:///./app.db --out live.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PASSWORD = "bench-password"
+SEARCH_TERMS = ["wid", "gadget", "blue", "pro", "mini", "set", "lamp", "case"]
+ADJECTIVES = ["Blue", "Red", "Mini", "Pro", "Classic", "Smart", "Eco", "Ultra"]
+NOUNS = ["Widget", "Gadget", "Lamp", "Case", "Mug", "Chair", "Set", "Cable"]
+
+# Scenario name -> relative weight
+SCENARIOS = {
+    "browse": 30,
+    "search": 20,
+    "product": 20,
+    "add_to_cart": 12,
+    "checkout": 8,
+    "pay": 5,
+    "login": 5,
+}
+
+
+def user_email(i: int) -> str:
+    return f"bench{i}@example.com"
+
+
+def seed(database_url: str, products: int, users: int, carts: int, orders: int):
+    """Fill the database at `database_url` with benchmark data (skipping
+    tables that already hold at least the requested number of rows)."""
+    from sqlalchemy import create_engine, func, insert, select
+    from sqlalchemy.orm import Session
+
+    from app import models
+    from app.db import Base
+    from app.security import get_password_hash
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    rng = random.Random(42)
+
+    def missing(db, model, wanted):
+        return max(wanted - db.scalar(select(func.count()).select_from(model)), 0)
+
+    with Session(engine) as db:
+        n = missing(db, models.Product, products)
+        for start in range(0, n, 5000):
+            db.execute(insert(models.Product), [
+                {
+                    "name": f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {start + i}",
+                    "price": round(rng.uniform(1, 500), 2),
+                }
+                for i in range(min(5000, n - start))
+            ])
+        n = missing(db, models.User, users)
+        if n:
+            # One bcrypt hash shared by every bench user keeps seeding fast
+            hashed = get_password_hash(PASSWORD)
+            offset = db.scalar(select(func.count()).select_from(models.User))
+            db.execute(insert(models.User), [
+                {"email": user_email(offset + i), "hashed_password": hashed, "is_active": True} for i in range(n)
+            ])
+        product_ids = db.scalars(select(models.Product.id)).all()
+        user_ids = db.scalars(select(models.User.id)).all() or [None]
+        for _ in range(missing(db, models.Cart, carts)):
+            cart = models.Cart(user_id=rng.choice(user_ids))
+            db.add(cart)
+            db.flush()
+            db.execute(insert(models.CartItem), [
+                {"cart_id": cart.id, "product_id": pid, "quantity": rng.randint(1, 3)}
+                for pid in rng.sample(product_ids, min(3, len(product_ids)))
+            ])
+        for _ in range(missing(db, models.Order, orders)):
+            lines = [(pid, rng.randint(1, 3), round(rng.uniform(1, 500), 2)) for pid in rng.sample(product_ids, min(3, len(product_ids)))]
+            order = models.Order(
+                user_id=rng.choice(user_ids),
+                total_amount=sum(q * price for _, q, price in lines),
+                paid=rng.random() < 0.5,
+            )
+            db.add(order)
+            db.flush()
+            db.execute(insert(models.OrderItem), [
+                {"order_id": order.id, "product_id": pid, "quantity": q, "unit_price": price} for pid, q, price in lines
+            ])
+        db.commit()
+    engine.dispose()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    async def call(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        self.samples.setdefault(route, []).append(time.perf_counter() - start)
+        if response is None or response.status_code >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            return None
+        return response
+
+
+class Scenarios:
+    """The user journeys; each method issues one scenario's requests."""
+
+    def __init__(self, client: httpx.AsyncClient, rec: Recorder, product_ids: list, users: int, rng: random.Random):
+        self.client, self.rec, self.product_ids, self.users, self.rng = client, rec, product_ids, users, rng
+
+    async def browse(self):
+        pages = max(len(self.product_ids) // 20, 1)
+        await self.rec.call(self.client, "GET /products/", "GET", "/products/", params={"page": self.rng.randint(1, min(pages, 50))})
+
+    async def search(self):
+        await self.rec.call(self.client, "GET /products/?q", "GET", "/products/", params={"q": self.rng.choice(SEARCH_TERMS)})
+        await self.rec.call(self.client, "GET /products/suggest", "GET", "/products/suggest", params={"q": self.rng.choice(SEARCH_TERMS)})
+
+    async def product(self):
+        await self.rec.call(self.client, "GET /products/{id}", "GET", f"/products/{self.rng.choice(self.product_ids)}")
+
+    async def _cart(self, lines: int):
+        r = await self.rec.call(self.client, "POST /carts/", "POST", "/carts/")
+        if r is None:
+            return None
+        cart_id = r.json()["id"]
+        for pid in self.rng.sample(self.product_ids, min(lines, len(self.product_ids))):
+            await self.rec.call(
+                self.client, "POST /carts/{id}/items", "POST", f"/carts/{cart_id}/items",
+                json={"product_id": pid, "quantity": self.rng.randint(1, 3)},
+            )
+        return cart_id
+
+    async def add_to_cart(self):
+        cart_id = await self._cart(self.rng.randint(1, 3))
+        if cart_id is not None:
+            await self.rec.call(self.client, "GET /carts/{id}", "GET", f"/carts/{cart_id}")
+
+    async def checkout(self):
+        cart_id = await self._cart(self.rng.randint(1, 4))
+        if cart_id is None:
+            return None
+        r = await self.rec.call(
+            self.client, "POST /carts/{id}/checkout", "POST", f"/carts/{cart_id}/checkout",
+            headers={"Idempotency-Key": f"bench-{cart_id}-{self.rng.getrandbits(64):x}"},
+        )
+        return r.json() if r is not None else None
+
+    async def pay(self):
+        order = await self.checkout()
+        if order is None:
+            return
+        await self.rec.call(
+            self.client, "POST /payments/pay", "POST", "/payments/pay",
+            json={"order_id": order["id"], "amount": order["total_amount"]},
+        )
+        await self.rec.call(self.client, "GET /orders/{id}", "GET", f"/orders/{order['id']}")
+
+    async def login(self):
+        if not self.users:
+            return
+        await self.rec.call(
+            self.client, "POST /auth/token", "POST", "/auth/token",
+            data={"username": user_email(self.rng.randrange(self.users)), "password": PASSWORD},
+        )
+
+
+async def discover_products(client: httpx.AsyncClient, limit: int = 2000) -> list:
+    ids, after = [], None
+    while len(ids) < limit:
+        params = {"per_page": 100, "with_total": "false"}
+        if after:
+            params["after"] = after
+        page = (await client.get("/products/", params=params)).raise_for_status().json()
+        ids.extend(item["id"] for item in page["items"])
+        after = page.get("next_cursor")
+        if not after:
+            break
+    return ids
+
+
+async def drive(client: httpx.AsyncClient, args) -> dict:
+    product_ids = await discover_products(client)
+    if not product_ids:
+        raise SystemExit("no products to benchmark against; seed first")
+    rec = Recorder()
+    names, weights = zip(*SCENARIOS.items())
+    deadline = time.perf_counter() + args.duration
+
+    async def virtual_user(n: int):
+        rng = random.Random(args.seed_rng + n)
+        scenarios = Scenarios(client, rec, product_ids, args.users, rng)
+        while time.perf_counter() < deadline:
+            await getattr(scenarios, rng.choices(names, weights)[0])()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(n) for n in range(args.concurrency)))
+    return report(rec, time.perf_counter() - start)
+
+
+def percentile(sorted_samples: list, pct: float) -> float:
+    # Nearest-rank percentile
+    index = max(int(round(pct / 100 * len(sorted_samples) + 0.5)) - 1, 0)
+    return sorted_samples[min(index, len(sorted_samples) - 1)]
+
+
+def report(rec: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route, samples in rec.samples.items():
+        samples.sort()
+        routes[route] = {
+            "requests": len(samples),
+            "errors": rec.errors.get(route, 0),
+            "rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        }
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(rec.errors.values()),
+        "rps": round(total / elapsed, 1),
+        "routes": routes,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_in_process(args) -> dict:
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport doesn't send lifespan events; run startup/shutdown here
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await drive(client, args)
+
+
+async def run_live(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        return await drive(client, args)
+
+
+def compare(before: dict, after: dict):
+    print(f"{'route':<28}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'rps':>16}")
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        b, a = before["routes"].get(route), after["routes"].get(route)
+        if not (a and b):
+            continue
+        cells = [f"{b[k]:>7} -> {a[k]:<7}" for k in ("p50_ms", "p95_ms", "p99_ms", "rps")]
+        print(f"{route:<28}" + "".join(f"{c:>18}" for c in cells))
+    print(f"{'total rps':<28}{before['rps']} -> {after['rps']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    parser.add_argument("--database-url", help="database to seed (and, in-process, to serve from)")
+    parser.add_argument("--no-seed", action="store_true", help="use the data already in the database")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--carts", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--seed-rng", type=int, default=1, help="random seed for the traffic mix")
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--compare", help="earlier results file to print deltas against")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.database_url is None and not args.url:
+        tmp = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    if args.database_url and not args.url:
+        # Must be set before app.db is imported
+        os.environ["DATABASE_URL"] = args.database_url
+    try:
+        if not args.no_seed:
+            if not args.database_url:
+                sys.exit("--database-url is required to seed a live server's database (or pass --no-seed)")
+            seed_start = time.perf_counter()
+            seed(args.database_url, args.products, args.users, args.carts, args.orders)
+            print(f"seeded in {time.perf_counter() - seed_start:.1f}s", file=sys.stderr)
+        result = asyncio.run(run_live(args) if args.url else run_in_process(args))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    result["config"] = {
+        "mode": "live" if args.url else "in-process",
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        **{k: getattr(args, k) for k in ("products", "users", "carts", "orders", "concurrency", "duration", "seed_rng")},
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"{result['requests']} requests, {result['rps']} req/s, {result['errors']} errors -> {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
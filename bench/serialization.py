@@ -0,0 +1,107 @@
+"""Per-item cost of building a product page response: default vs fast path.
+
+For a page of N products this times the database read plus serialization:
+
+- `default`: ORM instances, validated against the `response_model` from
+  attributes, dumped to Python objects and encoded with `json.dumps` (what
+  FastAPI does for a route returning ORM objects).
+- `adapter`: `crud.PRODUCT_COLUMNS` row tuples validated into snapshots and
+  encoded by a prebuilt `TypeAdapter` (`responses.json_response(value, tp)`).
+- `orjson`: the same rows as dicts encoded by orjson (`responses.dumps`).
+
+    python -m bench.serialization --products 5000 --sizes 20 100 500 --repeat 50
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.db import Base
+from app.responses import adapter, dumps
+
+
+def seed(engine, products: int):
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(
+            models.Product(
+                name=f"Product {i}",
+                price=round(random.uniform(1, 500), 2),
+                image_url=f"/static/uploads/{i:064x}.jpg",
+                sku=f"SKU-{i}",
+                image_variants={"thumb": f"/static/uploads/{i:064x}_thumb.webp"},
+            )
+            for i in range(products)
+        )
+        db.commit()
+
+
+def default_path(db, size: int) -> bytes:
+    rows = db.query(models.Product).order_by(models.Product.id).limit(size).all()
+    page = {"items": rows, "total": None, "page": 1, "per_page": size, "next_cursor": None}
+    validated = adapter(schemas.PaginatedProducts).validate_python(page, from_attributes=True)
+    content = adapter(schemas.PaginatedProducts).dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def adapter_path(db, size: int) -> bytes:
+    rows = db.query(*crud.PRODUCT_COLUMNS).order_by(models.Product.id).limit(size).all()
+    items = adapter(List[schemas.Product]).validate_python(rows, from_attributes=True)
+    page = schemas.PaginatedProducts(items=items, page=1, per_page=size)
+    return adapter(schemas.PaginatedProducts).dump_json(page)
+
+
+def orjson_path(db, size: int) -> bytes:
+    rows = db.query(*crud.PRODUCT_COLUMNS).order_by(models.Product.id).limit(size).all()
+    return dumps({"items": [row._asdict() for row in rows], "total": None, "page": 1, "per_page": size, "next_cursor": None})
+
+
+PATHS = {"default": default_path, "adapter": adapter_path, "orjson": orjson_path}
+
+
+def measure(factory, fn, size: int, repeat: int) -> float:
+    """Best-of-`repeat` microseconds per item (a fresh session each run, so
+    the identity map never short-circuits ORM loading)."""
+    best = float("inf")
+    for _ in range(repeat):
+        with factory() as db:
+            start = time.perf_counter()
+            fn(db, size)
+            best = min(best, time.perf_counter() - start)
+    return best / size * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100, 500])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        seed(engine, max(args.products, max(args.sizes)))
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            # Every path must produce the same document
+            outputs = {name: json.loads(fn(db, 5)) for name, fn in PATHS.items()}
+            assert all(out == outputs["default"] for out in outputs.values()), outputs
+        for size in args.sizes:
+            result = {name: measure(factory, fn, size, args.repeat) for name, fn in PATHS.items()}
+            print({
+                "items": size,
+                **{f"{name}_us_per_item": round(us, 2) for name, us in result.items()},
+                **{f"{name}_speedup": round(result["default"] / us, 2) for name, us in result.items() if name != "default"},
+            })
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
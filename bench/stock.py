@@ -0,0 +1,120 @@
+"""Flash-sale checkout: stock never goes negative under concurrent buyers.
+
+Many threads each run a full cart -> checkout against one product with
+limited stock, until it sells out. Afterwards (and continuously, via a
+monitor thread) it checks that stock never went below zero and that every
+unit sold belongs to exactly one order, and reports checkout throughput for
+a plain counter and for sharded counters.
+
+    python -m bench.stock --stock 500 --buyers 32 --max-quantity 3
+    python -m bench.stock --database-url postgresql://localhost/bench --shards 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.db import Base, make_engine
+
+
+def run(url: str, stock: int, shards: int, buyers: int, max_quantity: int) -> dict:
+    engine = make_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        product = crud.create_product(db, schemas.ProductCreate(name="Flash sale item", price=9.99))
+        product_id = product.id
+        crud.set_stock(db, product_id, stock, shards or None)
+
+    sold_out = threading.Event()
+    counts = {"orders": 0, "rejected": 0, "errors": 0}
+    lowest = [stock]
+    lock = threading.Lock()
+
+    def current(db) -> int:
+        return crud.get_stock(db, product_id).stock
+
+    def buyer(n: int):
+        rng = random.Random(n)
+        with factory() as db:
+            while not sold_out.is_set():
+                cart = crud.create_cart(db)
+                product = crud.get_product(db, product_id)
+                crud.add_item_to_cart(db, cart, product, rng.randint(1, max_quantity))
+                try:
+                    crud.create_order_from_cart(db, cart)
+                    outcome = "orders"
+                except crud.OutOfStock:
+                    outcome = "rejected"
+                    if current(db) == 0:
+                        sold_out.set()
+                except Exception:
+                    db.rollback()
+                    outcome = "errors"
+                with lock:
+                    counts[outcome] += 1
+
+    def monitor():
+        with factory() as db:
+            while not sold_out.is_set():
+                level = current(db)
+                db.rollback()
+                lowest[0] = min(lowest[0], level)
+                time.sleep(0.001)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(buyers)]
+    watcher = threading.Thread(target=monitor)
+    start = time.perf_counter()
+    watcher.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    watcher.join()
+
+    with factory() as db:
+        remaining = current(db)
+        sold = db.query(func.coalesce(func.sum(models.OrderItem.quantity), 0)).filter(
+            models.OrderItem.product_id == product_id
+        ).scalar()
+        negative_shards = db.query(models.StockShard).filter(models.StockShard.stock < 0).count()
+    engine.dispose()
+
+    assert min(lowest[0], remaining) >= 0 and not negative_shards, "stock went negative"
+    assert sold + remaining == stock, f"sold {sold} + remaining {remaining} != initial {stock}"
+    return {
+        "shards": shards or 1,
+        "checkouts_per_s": round(counts["orders"] / elapsed, 1),
+        **counts,
+        "units_sold": sold,
+        "remaining": remaining,
+        "lowest_seen": min(lowest[0], remaining),
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--buyers", type=int, default=32)
+    parser.add_argument("--max-quantity", type=int, default=3)
+    parser.add_argument("--shards", type=int, default=8, help="shard count for the sharded run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        for shards in (0, args.shards):
+            print(run(url, args.stock, shards, args.buyers, args.max_quantity))
+
+
+if __name__ == "__main__":
+    main()
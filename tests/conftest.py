@@ -0,0 +1,55 @@
+import os
+import tempfile
+
+# The app binds its engines when imported, so point it at a throwaway SQLite
+# database (and keep background workers and network providers out of the
+# way) before anything imports it.
+_tmp = tempfile.mkdtemp(prefix="ecommerce-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.pop("READ_DATABASE_URL", None)
+os.environ.setdefault("WEBHOOK_WORKER", "0")
+os.environ.setdefault("RESERVATION_SWEEPER", "0")
+os.environ.setdefault("PAYMENT_PROVIDER", "fake")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app.db import Base, SessionLocal, engine, make_engine
+from app.main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def db(client):
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def factory(tmp_path):
+    """Session factory on a separate SQLite database, so concurrent writers
+    don't interfere with the rest of the suite."""
+    separate = make_engine(f"sqlite:///{tmp_path / 'separate.db'}")
+    Base.metadata.create_all(separate)
+    yield sessionmaker(bind=separate)
+    separate.dispose()
+
+
+@pytest.fixture
+def queries():
+    """SQL statements run on the primary engine while the test runs."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
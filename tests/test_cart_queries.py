@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import inspect
+
+from app import crud, schemas
+
+
+def make_cart(db, lines: int):
+    cart = crud.create_cart(db)
+    for i in range(lines):
+        product = crud.create_product(db, schemas.ProductCreate(name=f"Cart product {i}", price=1 + i))
+        crud.add_item_to_cart(db, cart, product, 1)
+    return cart.id
+
+
+@pytest.mark.parametrize("lines", [1, 25])
+def test_get_cart_query_count_is_constant(client, db, queries, lines):
+    cart_id = make_cart(db, lines)
+    queries.clear()
+
+    response = client.get(f"/carts/{cart_id}")
+
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == lines
+    # cart, its lines, their products
+    assert len(queries) == 3, queries
+
+
+@pytest.mark.parametrize("lines", [1, 25])
+def test_add_item_does_not_scan_cart_items(db, queries, lines):
+    cart_id = make_cart(db, lines)
+    product = crud.create_product(db, schemas.ProductCreate(name="Added product", price=3))
+    cart = crud.get_cart(db, cart_id, load_items=False)
+    queries.clear()
+
+    item = crud.add_item_to_cart(db, cart, product, 2)
+
+    assert item.quantity == 2
+    assert "items" not in inspect(cart).dict
+    assert not [q for q in queries if "cart_items.cart_id" in q.partition("WHERE")[2]], queries
+    # upsert, then the line read back with its product
+    assert len([q for q in queries if not q.lstrip().upper().startswith(("BEGIN", "COMMIT"))]) == 2, queries
+
+
+def test_add_item_bumps_existing_line(db):
+    cart = crud.get_cart(db, make_cart(db, 1))
+    product_id = cart.items[0].product_id
+    product = crud.get_product_cached(db, product_id)
+
+    crud.add_item_to_cart(db, cart, product, 2)
+
+    lines = crud.get_cart(db, cart.id).items
+    assert [(line.product_id, line.quantity) for line in lines] == [(product_id, 3)]
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from app import crud, models, schemas
+
+THREADS = 8
+
+
+def filled_cart(db, quantity: int = 2):
+    product = crud.create_product(db, schemas.ProductCreate(name="Checkout item", price=4, stock=50))
+    cart = crud.create_cart(db)
+    crud.add_item_to_cart(db, cart, product, quantity)
+    return cart
+
+
+def concurrently(factory, cart_id: int, key_for):
+    """Check out `cart_id` from THREADS sessions at once; returns the order
+    ids and the errors raised."""
+    results = []
+    start = threading.Barrier(THREADS)
+
+    def attempt(n: int):
+        with factory() as db:
+            cart = crud.get_cart(db, cart_id, load_items=False)
+            start.wait()
+            try:
+                results.append(crud.create_order_from_cart(db, cart, key_for(n)).id)
+            except ValueError as exc:
+                db.rollback()
+                results.append(exc)
+
+    threads = [threading.Thread(target=attempt, args=(n,)) for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [r for r in results if isinstance(r, int)], [r for r in results if not isinstance(r, int)]
+
+
+def test_retry_with_same_key_returns_the_same_order(factory):
+    with factory() as db:
+        cart = filled_cart(db)
+        first = crud.create_order_from_cart(db, cart, "key-retry").id
+
+        assert crud.create_order_from_cart(db, cart, "key-retry").id == first
+        assert db.query(models.Order).count() == 1
+        assert db.query(models.OrderItem.quantity).scalar() == 2
+
+
+def test_same_key_on_another_cart_is_rejected(factory):
+    with factory() as db:
+        crud.create_order_from_cart(db, filled_cart(db), "key-shared")
+        other = filled_cart(db)
+
+        with pytest.raises(ValueError, match="another cart"):
+            crud.create_order_from_cart(db, other, "key-shared")
+        assert db.query(models.Order).count() == 1
+
+
+def test_same_key_on_another_cart_gets_400(client, db):
+    key = f"key-http-{crud.create_cart(db).id}"
+    first, second = filled_cart(db), filled_cart(db)
+
+    assert client.post(f"/carts/{first.id}/checkout", headers={"Idempotency-Key": key}).status_code == 200
+    response = client.post(f"/carts/{second.id}/checkout", headers={"Idempotency-Key": key})
+    assert response.status_code == 400
+
+
+def test_concurrent_checkouts_of_one_cart_make_one_order(factory):
+    with factory() as db:
+        cart_id = filled_cart(db).id
+
+    orders, errors = concurrently(factory, cart_id, lambda n: None)
+
+    assert len(orders) == 1
+    assert [str(e) for e in errors] == ["Cart is empty"] * (THREADS - 1)
+    with factory() as db:
+        assert db.query(models.Order).filter(models.Order.cart_id == cart_id).count() == 1
+
+
+def test_concurrent_retries_with_one_key_share_the_order(factory):
+    with factory() as db:
+        cart_id = filled_cart(db).id
+
+    orders, errors = concurrently(factory, cart_id, lambda n: "key-concurrent")
+
+    assert not errors
+    assert len(orders) == THREADS and len(set(orders)) == 1
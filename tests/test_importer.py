@@ -0,0 +1,50 @@
+import io
+import uuid
+
+from app import crud, importer, models
+
+
+def _import(db, text, **kwargs):
+    return importer.import_products(db, io.StringIO(text), "csv", **kwargs)
+
+
+def _product(db, sku):
+    db.expire_all()
+    return db.query(models.Product).filter(models.Product.sku == sku).one()
+
+
+def test_duplicate_skus_are_counted_as_superseded(db):
+    a, b = f"A-{uuid.uuid4().hex[:8]}", f"B-{uuid.uuid4().hex[:8]}"
+    report = _import(db, (
+        "name,price,sku\n"
+        f"First A,1.00,{a}\n"
+        f"Second A,2.00,{a}\n"
+        "Bad price,nope,\n"
+        f"Only B,3.00,{b}\n"
+        ",4.00,\n"
+    ))
+
+    assert (report.rows, report.imported, report.failed, report.superseded) == (5, 2, 2, 1)
+    assert report.rows == report.imported + report.failed + report.superseded
+    assert (_product(db, a).name, _product(db, a).price) == ("Second A", 2.0)
+
+
+def test_duplicates_in_different_batches_are_each_written(db):
+    sku = f"C-{uuid.uuid4().hex[:8]}"
+    report = _import(db, f"name,price,sku\nOld,1.00,{sku}\nNew,2.00,{sku}\n", batch_size=1)
+
+    assert (report.imported, report.superseded, report.batches) == (2, 0, 2)
+    assert _product(db, sku).name == "New"
+
+
+def test_stock_is_imported_and_kept_when_left_empty(db):
+    sku = f"S-{uuid.uuid4().hex[:8]}"
+    _import(db, f"name,price,sku,stock\nStocked,5.00,{sku},7\n")
+    product = _product(db, sku)
+    assert product.stock == 7
+
+    _import(db, f"name,price,sku,stock\nRenamed,5.00,{sku},\n")
+    assert (_product(db, sku).name, crud.get_stock(db, product.id).stock) == ("Renamed", 7)
+
+    _import(db, f"name,price,sku,stock\nRenamed,5.00,{sku},3\n")
+    assert crud.get_stock(db, product.id).stock == 3
@@ -0,0 +1,22 @@
+from fastapi import Depends, Request
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.db import get_db
+from app.main import app
+
+
+def test_route_sees_its_own_db_stats(client):
+    def probe(request: Request, db: Session = Depends(get_db)):
+        before = request.state.db_stats.queries
+        db.execute(text("SELECT 1"))
+        db.execute(text("SELECT 2"))
+        return {"before": before, "after": request.state.db_stats.queries}
+
+    app.add_api_route("/_test/db-stats", probe)
+    try:
+        body = client.get("/_test/db-stats").json()
+    finally:
+        app.router.routes.pop()
+
+    assert body["after"] - body["before"] == 2
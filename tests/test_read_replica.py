@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models, schemas
+from app.db import Base, engine, get_read_db, make_engine
+from app.main import app
+from app.routers import products
+
+
+@pytest.fixture
+def replica(tmp_path):
+    """A second SQLite database standing in for a lagging read replica."""
+    replica_engine = make_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(replica_engine)
+    yield replica_engine
+    replica_engine.dispose()
+
+
+def _copy_primary(replica_engine):
+    src, dst = engine.raw_connection(), replica_engine.raw_connection()
+    try:
+        src.driver_connection.backup(dst.driver_connection)
+    finally:
+        dst.close()
+        src.close()
+
+
+def test_lagging_replica_does_not_churn_the_catalog_cache(db, replica, monkeypatch):
+    monkeypatch.setattr(crud, "CATALOG_VERSION_POLL", 0)
+    product_id = crud.create_product(db, schemas.ProductCreate(name="Replicated", price=3)).id
+    _copy_primary(replica)
+    crud.bump_catalog_version(db)  # a later write the replica hasn't seen yet
+    db.commit()
+
+    with sessionmaker(bind=replica)() as replica_db:
+        # Each engine's first poll may clear the cache once; after that,
+        # alternating between them must keep serving hits
+        crud.get_product_cached(replica_db, product_id)
+        crud.get_product_cached(db, product_id)
+        before = crud.catalog_cache_stats()["products"]
+        for _ in range(3):
+            assert crud.get_product_cached(replica_db, product_id)
+            assert crud.get_product_cached(db, product_id)
+    after = crud.catalog_cache_stats()["products"]
+
+    assert after["misses"] == before["misses"]
+    assert after["hits"] - before["hits"] == 6
+
+
+def test_product_reads_fall_back_to_the_primary(client, db, replica, monkeypatch):
+    factory = sessionmaker(bind=replica)
+
+    def replica_db():
+        with factory() as session:
+            yield session
+
+    monkeypatch.setattr(products, "read_engine", replica)
+    app.dependency_overrides[get_read_db] = replica_db
+    try:
+        product_id = crud.create_product(db, schemas.ProductCreate(name="Just created", price=4)).id
+        assert client.get(f"/products/{product_id}").json()["name"] == "Just created"
+        batch = client.get(f"/products/batch?ids={product_id},999999999").json()
+        assert [p["id"] for p in batch["items"]] == [product_id]
+        assert batch["missing"] == [999999999]
+    finally:
+        app.dependency_overrides.pop(get_read_db)
+    with factory() as replica_db_session:
+        assert replica_db_session.get(models.Product, product_id) is None
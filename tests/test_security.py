@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.security import HashingBusy, _HashExecutor
+
+
+def test_cancelled_caller_keeps_its_slot_until_the_hash_finishes():
+    hasher = _HashExecutor(workers=1, max_queue=0)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_hash():
+        started.set()
+        release.wait(5)
+        return "hash"
+
+    async def scenario():
+        waiter = asyncio.ensure_future(hasher.run(slow_hash))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        # The bcrypt call is still running: no room for another one
+        assert hasher.stats()["in_flight"] == 1
+        with pytest.raises(HashingBusy):
+            await hasher.run(str, "x")
+
+        release.set()
+        while hasher.stats()["in_flight"]:
+            await asyncio.sleep(0.01)
+        assert await hasher.run(str, "x") == "x"
+
+    asyncio.run(scenario())
+    stats = hasher.stats()
+    assert (stats["completed"], stats["failed"], stats["rejected"]) == (2, 0, 1)
+
+
+def test_failed_hashes_are_counted_separately():
+    hasher = _HashExecutor(workers=1, max_queue=4)
+
+    def broken():
+        raise ValueError("bad hash")
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await hasher.run(broken)
+        await hasher.run(str, "ok")
+
+    asyncio.run(scenario())
+    stats = hasher.stats()
+    assert (stats["completed"], stats["failed"], stats["in_flight"]) == (1, 1, 0)
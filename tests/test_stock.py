@@ -0,0 +1,131 @@
+import random
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+from app import crud, models, schemas
+
+
+def checkout(db, product_id: int, quantity: int):
+    cart = crud.create_cart(db)
+    crud.add_item_to_cart(db, cart, crud.get_product(db, product_id), quantity)
+    return crud.create_order_from_cart(db, cart)
+
+
+@pytest.mark.parametrize("shards", [None, 4])
+def test_concurrent_checkouts_never_oversell(factory, shards):
+    stock = 40
+    with factory() as db:
+        product_id = crud.create_product(db, schemas.ProductCreate(name="Flash sale", price=5)).id
+        crud.set_stock(db, product_id, stock, shards)
+
+    outcomes = []
+    lowest = [stock]
+
+    def buyer(n: int):
+        rng = random.Random(n)
+        with factory() as db:
+            for _ in range(20):
+                try:
+                    checkout(db, product_id, rng.randint(1, 3))
+                    outcomes.append("order")
+                except crud.OutOfStock:
+                    outcomes.append("rejected")
+                except Exception as exc:
+                    db.rollback()
+                    outcomes.append(repr(exc))
+                level = crud.get_stock(db, product_id).stock
+                db.rollback()
+                lowest[0] = min(lowest[0], level)
+
+    threads = [threading.Thread(target=buyer, args=(n,)) for n in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with factory() as db:
+        remaining = crud.get_stock(db, product_id).stock
+        sold = db.query(func.coalesce(func.sum(models.OrderItem.quantity), 0)).filter(
+            models.OrderItem.product_id == product_id
+        ).scalar()
+        negative_shards = db.query(models.StockShard).filter(models.StockShard.stock < 0).count()
+
+    assert set(outcomes) <= {"order", "rejected"}, outcomes
+    assert "rejected" in outcomes
+    assert lowest[0] >= 0 and remaining >= 0 and not negative_shards
+    assert sold + remaining == stock
+
+
+def expire_and_release(db, order_id: int):
+    db.query(models.Order).filter(models.Order.id == order_id).update(
+        {"reserved_until": datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+    assert crud.release_expired_reservations(db) == 1
+
+
+def test_late_payment_takes_released_stock_again(factory):
+    with factory() as db:
+        product_id = crud.create_product(db, schemas.ProductCreate(name="Late", price=5, stock=5)).id
+        order_id = checkout(db, product_id, 2).id
+        expire_and_release(db, order_id)
+        assert crud.get_stock(db, product_id).stock == 5
+
+        payment = crud.record_payment(db, order_id, 10.0, provider="stripe", reference="cs_late")
+        db.commit()
+
+        order = crud.get_order(db, order_id)
+        assert payment.status == "completed" and order.paid and order.stock_released_at is None
+        assert crud.get_stock(db, product_id).stock == 3
+        assert crud.record_payment(db, order_id, 10.0, provider="stripe", reference="cs_late") is None
+
+
+def test_late_payment_for_sold_out_order_is_kept_for_refund(factory):
+    with factory() as db:
+        product_id = crud.create_product(db, schemas.ProductCreate(name="Gone", price=5, stock=3)).id
+        order_id = checkout(db, product_id, 3).id
+        expire_and_release(db, order_id)
+        checkout(db, product_id, 3)
+
+        payment = crud.record_payment(db, order_id, 15.0, provider="stripe", reference="cs_gone")
+        db.commit()
+
+        order = crud.get_order(db, order_id)
+        assert payment.status == "refund_required"
+        assert not order.paid and order.stock_released_at is not None
+        assert crud.get_stock(db, product_id).stock == 0
+
+
+def test_reservation_extensions_stop_at_the_maximum_hold(factory):
+    with factory() as db:
+        product_id = crud.create_product(db, schemas.ProductCreate(name="Held", price=5, stock=5)).id
+        order_id = checkout(db, product_id, 1).id
+        now = datetime.utcnow().replace(microsecond=0)
+        placed = now - timedelta(seconds=crud.STOCK_RESERVATION_MAX_SECONDS) + timedelta(minutes=10)
+        seen = now + timedelta(minutes=5)
+        db.query(models.Order).filter(models.Order.id == order_id).update({"created_at": placed, "reserved_until": seen})
+        db.commit()
+
+        capped = crud.extend_reservation(db, order_id, seen, now + timedelta(hours=1))
+        assert capped == now + timedelta(minutes=10)
+        # At the cap: asking again changes nothing
+        assert crud.extend_reservation(db, order_id, capped, now + timedelta(hours=2)) == capped
+
+
+def test_checkout_session_is_refused_once_the_hold_is_used_up(client, db):
+    product = crud.create_product(db, schemas.ProductCreate(name="Long held", price=5, stock=5))
+    order = checkout(db, product.id, 1)
+    now = datetime.utcnow()
+    db.query(models.Order).filter(models.Order.id == order.id).update({
+        "created_at": now - timedelta(seconds=crud.STOCK_RESERVATION_MAX_SECONDS),
+        "reserved_until": now + timedelta(minutes=5),
+    })
+    db.commit()
+
+    response = client.post("/payments/create-checkout-session/", json={"order_id": order.id})
+    assert response.status_code == 409
+    db.expire_all()
+    assert crud.get_order(db, order.id).reserved_until < now + timedelta(minutes=6)
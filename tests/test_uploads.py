@@ -0,0 +1,85 @@
+import asyncio
+import os
+import tempfile
+import uuid
+
+import pytest
+
+from app import images, uploads
+from app.routers import products
+
+# Smallest valid PNG: 1x1 transparent pixel
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6300010000000500010d0a2db40000000049454e44ae426082"
+)
+
+
+@pytest.fixture
+def upload_dirs(tmp_path, monkeypatch):
+    """Point uploads at a throwaway tree shaped like app/ (static/uploads
+    plus the unserved upload_tmp next to static)."""
+    upload_dir, tmp_dir = tmp_path / "static" / "uploads", tmp_path / "upload_tmp"
+    upload_dir.mkdir(parents=True)
+    tmp_dir.mkdir()
+    monkeypatch.setattr(products, "UPLOAD_DIR", str(upload_dir))
+    monkeypatch.setattr(products, "UPLOAD_TMP_DIR", str(tmp_dir))
+    return str(upload_dir), str(tmp_dir)
+
+
+def upload(client, image: bytes, price: str = "9.5"):
+    return client.post(
+        "/products/upload",
+        data={"name": "Uploaded", "price": price},
+        files={"image": ("pixel.png", image, "image/png")},
+    )
+
+
+def test_partial_upload_is_written_outside_the_served_tree(client, upload_dirs, monkeypatch):
+    upload_dir, tmp_dir = upload_dirs
+    temp_dirs = []
+    mkstemp = tempfile.mkstemp
+
+    def recording_mkstemp(*args, **kwargs):
+        temp_dirs.append(kwargs.get("dir"))
+        return mkstemp(*args, **kwargs)
+
+    monkeypatch.setattr(uploads.tempfile, "mkstemp", recording_mkstemp)
+    response = upload(client, PNG)
+
+    assert response.status_code == 200
+    assert temp_dirs == [tmp_dir]
+    filename = response.json()["image_url"].rsplit("/", 1)[1]
+    assert filename in os.listdir(upload_dir)
+    assert os.listdir(tmp_dir) == []
+
+
+def test_default_temp_dir_is_not_under_static():
+    assert os.path.commonpath([products.UPLOAD_TMP_DIR, products.STATIC_DIR]) != products.STATIC_DIR
+    assert os.path.dirname(products.UPLOAD_TMP_DIR) == os.path.dirname(products.STATIC_DIR)
+
+
+def test_rejected_upload_leaves_no_temp_file(client, upload_dirs):
+    upload_dir, tmp_dir = upload_dirs
+
+    assert upload(client, b"GIF89a" + b"\0" * 10, price="free").status_code == 422
+    assert os.listdir(tmp_dir) == [] and os.listdir(upload_dir) == []
+
+
+def test_part_files_are_not_served(client):
+    name = f"{uuid.uuid4()}.png"
+    path = os.path.join(products.UPLOAD_DIR, name)
+    with open(path + ".part", "wb") as f:
+        f.write(PNG)
+    try:
+        assert client.get(f"/static/uploads/{name}.part").status_code == 404
+    finally:
+        os.unlink(path + ".part")
+
+
+def test_variant_failure_is_logged(tmp_path, caplog):
+    corrupt = tmp_path / "corrupt.png"
+    corrupt.write_bytes(PNG[:20])
+
+    assert asyncio.run(images.generate_variants(str(corrupt))) == {}
+    assert any(r.levelname == "ERROR" and str(corrupt) in r.getMessage() for r in caplog.records)
@@ -0,0 +1,107 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import crud, models, schemas, webhooks
+from app.routers import payments
+
+SECRET = "whsec_test"
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret(monkeypatch):
+    monkeypatch.setattr(payments, "STRIPE_WEBHOOK_SECRET", SECRET)
+
+
+def deliver(client, payload: bytes, secret: str = SECRET):
+    return client.post(
+        "/payments/webhook",
+        content=payload,
+        headers={"Stripe-Signature": webhooks.sign_payload(payload, secret), "Content-Type": "application/json"},
+    )
+
+
+def stored(db, event_id: str):
+    db.expire_all()
+    return db.get(models.WebhookEvent, event_id)
+
+
+@pytest.fixture
+def order(db):
+    product = crud.create_product(db, schemas.ProductCreate(name="Webhook item", price=12.5))
+    cart = crud.create_cart(db)
+    crud.add_item_to_cart(db, cart, product, 2)
+    return crud.create_order_from_cart(db, cart)
+
+
+def completed_session(order, session_id: str) -> dict:
+    return {
+        "id": session_id,
+        "object": "checkout.session",
+        "amount_total": round(order.total_amount * 100),
+        "metadata": {"order_id": str(order.id)},
+    }
+
+
+def test_duplicate_delivery_is_stored_once_and_paid_once(client, db, order):
+    payload = webhooks.fake_event("checkout.session.completed", completed_session(order, f"cs_{order.id}"))
+    event_id = json.loads(payload)["id"]
+
+    for _ in range(3):
+        assert deliver(client, payload).status_code == 200
+    assert db.query(models.WebhookEvent).filter(models.WebhookEvent.id == event_id).count() == 1
+
+    webhooks.process_due()
+    webhooks.process_due()
+
+    assert stored(db, event_id).status == "processed"
+    assert db.get(models.Order, order.id).paid
+    payments_made = db.query(models.Payment).filter(models.Payment.order_id == order.id).all()
+    assert [(p.status, p.reference) for p in payments_made] == [("completed", f"cs_{order.id}")]
+
+
+def test_redelivery_under_a_new_event_id_does_not_pay_twice(client, db, order):
+    session = completed_session(order, f"cs_again_{order.id}")
+    for _ in range(2):
+        deliver(client, webhooks.fake_event("checkout.session.completed", session))
+    webhooks.process_due()
+
+    assert db.query(models.Payment).filter(models.Payment.order_id == order.id).count() == 1
+
+
+def test_failing_handler_is_retried_with_backoff(client, db, monkeypatch):
+    def broken(db, obj):
+        raise RuntimeError("handler exploded")
+
+    monkeypatch.setitem(webhooks.HANDLERS, "test.broken", broken)
+    payload = webhooks.fake_event("test.broken", {"id": "obj_1"})
+    event_id = json.loads(payload)["id"]
+    deliver(client, payload)
+
+    try:
+        for attempt in (1, 2):
+            started = datetime.utcnow()
+            webhooks.process_due()
+            event = stored(db, event_id)
+            assert (event.status, event.attempts, event.processed_at) == ("pending", attempt, None)
+            assert "handler exploded" in event.last_error
+            # Exponential: the base delay, then twice that
+            delay = webhooks.WEBHOOK_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            assert abs((event.next_attempt_at - started).total_seconds() - delay) < 1
+
+            # Not due yet: another pass leaves it alone
+            webhooks.process_due()
+            assert stored(db, event_id).attempts == attempt
+            event.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+            db.commit()
+    finally:
+        db.query(models.WebhookEvent).filter(models.WebhookEvent.id == event_id).delete()
+        db.commit()
+
+
+def test_invalid_signature_is_rejected(client, db):
+    payload = webhooks.fake_event("checkout.session.completed", {"id": "cs_forged"})
+
+    assert deliver(client, payload, secret="whsec_wrong").status_code == 400
+    assert stored(db, json.loads(payload)["id"]) is None